@@ -0,0 +1,70 @@
+"""Check how long the core generation modules take to import
+
+Each module is imported in a fresh interpreter. None of them should import
+music21, which is only needed to notate.
+
+    python check_import_times.py [--budget SECONDS]
+
+"""
+import argparse
+import subprocess
+import sys
+
+
+MODULES = [
+    'utils',
+    'instrument_data',
+    'instrument_info',
+    'harmony',
+    'sections',
+    'notation_tools',
+    'music_tools',
+    'music_tools2',
+    'music_tools3',
+]
+
+# Seconds
+DEFAULT_BUDGET = 0.5
+
+
+MEASURE = '''
+import sys, time
+start = time.time()
+import {}
+print time.time() - start, 'music21' in sys.modules
+'''
+
+
+def measure_import_time(module_name):
+    output = subprocess.check_output([sys.executable, '-c', MEASURE.format(module_name)])
+    seconds, imports_music21 = output.split()[-2:]
+    return float(seconds), imports_music21 == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=DEFAULT_BUDGET,
+        help='Most seconds a module may take to import',
+    )
+    args = parser.parse_args()
+
+    ok = True
+    for module_name in MODULES:
+        seconds, imports_music21 = measure_import_time(module_name)
+        problems = []
+        if seconds > args.budget:
+            problems.append('over budget')
+        if imports_music21:
+            problems.append('imports music21')
+        ok = ok and not problems
+        print '{:<20} {:.3f}s  {}'.format(module_name, seconds, ', '.join(problems))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from collections import Counter
 import argparse
 
 from music_tools import Music, pitches_to_chord_type
-from utils import weighted_choice
+import sampling
+from sampling import weighted_choice, alias_table
+from harmony import ChordTable, interval_mask
 
 
 ALLOWED_HARMONIES = {
@@ -50,6 +52,9 @@ ALLOWED_HARMONIES = {
     (0, 13, 14): .1,
 }
 
+# Voiced chord types span up to 14 semitones above the lowest pitch
+ALLOWED_HARMONIES_TABLE = ChordTable(ALLOWED_HARMONIES, n_bits=15)
+
 # REVEALED_HARMONY_WEIGHTS = {
 #     0: 75,
 #     1: 100,
@@ -97,6 +102,17 @@ BLUES_PROGRESSION = [
 ]
 SCALE = (0, 2, 3, 4, 5, 7, 9, 11)
 
+# Bass note durations, by the beat within the bar the note starts on
+BASS_DURATIONS = [
+    alias_table([1,  2,  3, 4, 5, 6, 7, 8], [35, 24, 2, 6, 1, 1, 1, 2]),
+    alias_table([1,  2,  3,  4, 5, 6, 7], [35, 12, 16, 1, 1, 1, 3]),
+    alias_table([1,  2,  4, 6], [24, 24, 1, 2]),
+    alias_table([1,  2, 5], [40, 2, 5]),
+]
+
+REST_DURATIONS = alias_table([1, 2], [16, 1])
+LONG_REST_DURATIONS = alias_table([4, 5, 6, 7], [16, 12, 2, 1])
+
 
 class Movement1(object):
     def __init__(self):
@@ -219,14 +235,12 @@ class Movement1(object):
             self.stats['beats_since_last_rest'][changing.beats_since_last_rest()] += 1
 
             # Add a rest before the next note
-            rest_duration_options = [1,  2]
-            rest_duration_weights = [16, 1]
+            rest_durations = REST_DURATIONS
             if changing.beats_since_last_rest(rest_duration=4) > 40:
                 if random.random() < .5:
-                    rest_duration_options = [4,  5,  6, 7]
-                    rest_duration_weights = [16, 12, 2, 1]
+                    rest_durations = LONG_REST_DURATIONS
 
-            rest_duration = weighted_choice(rest_duration_options, rest_duration_weights)
+            rest_duration = rest_durations.draw()
 
             total_event_duration += rest_duration
             changing.add_note(pitch='rest', duration=rest_duration)
@@ -289,22 +303,16 @@ class Movement1(object):
         bar_number = int(changing.duration() % 4)
 
         for pitch_option in available_pitches:
-            harmony = holdovers + [pitch_option]
-            harmony.sort()
-            harmony = [ps - harmony[0] for ps in harmony]
-
-            harmony = list(set(harmony))
-            harmony.sort()
-            harmony = tuple(harmony)
+            harmony = interval_mask(holdovers + [pitch_option])
 
-            if harmony in ALLOWED_HARMONIES:
+            if ALLOWED_HARMONIES_TABLE.is_allowed(harmony):
                 pitch_options.append(pitch_option)
 
                 # The further away the new pitch from the previous pitch, the lower the weight
                 distance = abs(previous_pitch - pitch_option)
                 distance_weight = DISTANCE_WEIGHTS[distance]
 
-                harmony_weight = ALLOWED_HARMONIES[harmony]
+                harmony_weight = ALLOWED_HARMONIES_TABLE.weights[harmony]
 
                 blues_weight = 1
                 if pitch_option % 12 in BLUES_PROGRESSION[bar_number]:
@@ -370,20 +378,7 @@ class Movement1(object):
 
         pitch = weighted_choice(pitch_options, weights)
 
-        if beat_number == 0:
-            duration_options = [1,  2,  3, 4, 5, 6, 7, 8]
-            duration_weights = [35, 24, 2, 6, 1, 1, 1, 2]
-        elif beat_number == 1:
-            duration_options = [1,  2,  3,  4, 5, 6, 7]
-            duration_weights = [35, 12, 16, 1, 1, 1, 3]
-        elif beat_number == 2:
-            duration_options = [1,  2,  4, 6]
-            duration_weights = [24, 24, 1, 2]
-        elif beat_number == 3:
-            duration_options = [1,  2, 5]
-            duration_weights = [40, 2, 5]
-
-        duration = weighted_choice(duration_options, duration_weights)
+        duration = BASS_DURATIONS[beat_number].draw()
 
         self.bass.add_note(pitch=pitch, duration=duration)
 
@@ -395,11 +390,19 @@ def command_line_interface():
         '--dont-notate',
         help='dont generate notation',
         action="store_true")
+    parser.add_argument(
+        '-s',
+        '--seed',
+        help='seed the random number generators, to make the same music again',
+        type=int)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = command_line_interface()
+    if args.seed is not None:
+        random.seed(args.seed)
+        sampling.seed(args.seed)
 
     m1 = Movement1()
     if not args.dont_notate:
@@ -1,8 +1,7 @@
 #!/usr/bin/env python
 
 from notation_tools import Notation
-from instrument_data import instrument_data
-import utils
+from instrument_info import get_instrument_info
 
 
 class Note(object):
@@ -19,7 +18,7 @@ class Instrument(object):
         self.notes = []
         self._make_part_names(part_name)
 
-        self.range = instrument_data[self.instrument_name]['range']
+        self.range = get_instrument_info(self.instrument_name).range
         self._make_registers()
 
     def _make_part_names(self, part_name):
@@ -34,7 +33,7 @@ class Instrument(object):
             self.instrument_number = int(name_chunks[-1])  # if more than one of the same instrument
             self.part_id = part_name.replace(' ', '_')
 
-        self.abbreviation = instrument_data[self.instrument_name]['abbreviation']
+        self.abbreviation = get_instrument_info(self.instrument_name).abbreviation
         self.abbreviation_id = self.abbreviation
         if self.instrument_number > 1:
             self.abbreviation_id = '{}{}'.format(self.abbreviation, self.instrument_number)
@@ -44,16 +43,16 @@ class Instrument(object):
         return '<Instrument: {}>'.format(self.part_name)
 
     def _make_registers(self, n_chunks=7):
-        self.lowest_note = self.range[0]
-        self.highest_note = self.range[-1]
-
-        registers = list(utils.split_list(self.range, n_chunks=n_chunks))
-
-        self.middle_register = registers[3]  # assuming 7 divisions
-        self.highest_register = registers[-1]
-        self.lowest_register = registers[0]
-        self.safe_register = utils.flatten(registers[1:-1])
-        self.very_safe_register = utils.flatten(registers[2:-2])
+        # Worked out once per kind of instrument and shared
+        info = get_instrument_info(self.instrument_name, n_chunks=n_chunks)
+        self.lowest_note = info.lowest_note
+        self.highest_note = info.highest_note
+
+        self.middle_register = info.middle_register
+        self.highest_register = info.highest_register
+        self.lowest_register = info.lowest_register
+        self.safe_register = info.safe_register
+        self.very_safe_register = info.very_safe_register
 
     def add_note(self, pitch=None, duration=0.0):
         self.notes.append(Note(pitch=pitch, duration=duration))
@@ -9,17 +9,7 @@ import numpy as np
 from music_tools2 import Music
 from duration import Duration
 from sections import Layers
-
-
-def weighted_choice(indexes, weights):
-    # Make weights sum to 1.0
-    sum_weights = float(sum(weights))
-    weights = [w / sum_weights for w in weights]
-
-    # Weighted choice
-    index = np.random.choice(indexes, p=weights)
-
-    return index, weights
+from utils import weighted_choice
 
 
 def descending_weighted_choice(indexes):
@@ -148,10 +148,9 @@ for section in form:
             duration,
             window_offset=section.offset,
             window_duration=section.duration,
+            alignment=.5,
         )
 
-        openings = [o for o in openings if o % .5 == 0]
-
         if not openings:
             failures += 1
             if failures > 100:
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
 import random
-import itertools
 
 import numpy as np
 
-from music_tools3 import Music
+from music_tools3 import Fragment, Music
+from harmony import ChordTable
 from utils import round_to_sixteenth, flatten
 
 
@@ -105,6 +105,7 @@ chord_types = [
     (0, 3, 5, 8),
     (0, 2, 5, 9),
 ]
+chord_table = ChordTable(chord_types)
 
 
 instrument_register = {
@@ -179,7 +180,7 @@ def make_form():
 
 
 def make_fragment(n_quarters=8):
-    fragment = Music(
+    fragment = Fragment(
         title='Fragment',
         part_names=[
             'oboe',
@@ -210,122 +211,62 @@ def make_fragment(n_quarters=8):
             duration,
             window_offset=0,
             window_duration=8,
+            alignment=.5,
         )
 
-        openings = [o for o in openings if o % .5 == 0]
-
-        if not openings:
+        # Score the register at every opening at once, and only keep the openings where some pitch fits
+        good_openings = []
+        if openings:
+            pitches, allowed, weights = fragment.score_pitches(
+                inst.part_id,
+                openings,
+                duration,
+                chord_table,
+                pitches=instrument_register[inst.part_id],
+            )
+            good_openings = np.flatnonzero(allowed.any(axis=1)).tolist()
+
+        if not good_openings:
             failures += 1
             if failures > 100:
                 print 'failure x100'
                 break
             continue
 
-        offset = random.choice(openings)
-
-        notes_context, layers_context, analysis = fragment.get_context(inst.part_id, offset, duration)
-
-        existing_harmony = analysis['pitch_classes']
-
-        if not existing_harmony:
-            # print 'no harmony'
-            pitch = random.choice(instrument_register[inst.part_id])
-            fragment.grid[inst.part_id].put_note(offset, duration, pitch=pitch, staccato=staccato)
-            # inst.put_note(offset, duration, pitch=pitch, staccato=staccato)
-            continue
-
-        pitch_class_options = []
-        for pc in range(12):
-            proposed_harmony = sorted(list(set(existing_harmony + [pc])))
-            proposed_harmony_type = tuple([p - proposed_harmony[0] for p in proposed_harmony])
-            if proposed_harmony_type in chord_types:
-                pitch_class_options.append(pc)
-        pitch_class_options.sort()
-
-        pitch_options = [p for p in instrument_register[inst.part_id] if p % 12 in pitch_class_options]
-        if pitch_options:
-            pitch = random.choice(pitch_options)
-            # inst.put_note(offset, duration, pitch=pitch, staccato=staccato)
-            fragment.grid[inst.part_id].put_note(offset, duration, pitch=pitch, staccato=staccato)
+        opening = random.choice(good_openings)
+        offset = openings[opening]
+        pitch = random.choice(pitches[allowed[opening]].tolist())
+        # inst.put_note(offset, duration, pitch=pitch, staccato=staccato)
+        fragment.grid[inst.part_id].put_note(offset, duration, pitch=pitch, staccato=staccato)
 
     fragment.closeout()
 
     return fragment
 
 
-def get_good_variations(fragment):
-    good_variations = []
-
-    transpositions = [-2, -1, 0, 1, 2]
-    for instrument_transpositions in itertools.product(transpositions, repeat=4):
-
-        # Skip if it's just a transposition of all the instruments the same interval
-        if all(x == instrument_transpositions[0] for x in instrument_transpositions):
-            continue
-
-        fragment_v2 = Music(
+def get_good_variations(fragment, good_transpositions=None):
+    '''Make the variation for each good transposition only as it's asked for'''
+    if good_transpositions is None:
+        good_transpositions = fragment.find_transpositions(chord_table)
+    for instrument_transpositions in good_transpositions:
+        print instrument_transpositions
+        yield fragment.transpose(
+            instrument_transpositions,
             title='Fragment V2',
-            part_names=[
-                'oboe',
-                'bass_clarinet',
-                'vibraphone',
-                'bass',
-            ],
-            bpm=bpm,
-            n_quarters=8,
             output_dir_name='fragment_v2',
         )
 
-        for original_inst, new_instrument, transposition in zip(fragment.instruments, fragment_v2.instruments, instrument_transpositions):
-            for note in original_inst.finalized_notes:
-                pitch = None
-                if note.pitch != None:
-                    pitch = note.pitch + transposition
-
-                new_instrument.put_note(note.offset, note.duration, pitch=pitch, staccato=note.staccato)
-
-        fragment_v2.closeout()
-
-        # Test if the new variation meets some criteria (eg, only uses allowed harmonies)
-        goods = []
-        for sixteenth in fragment_v2.sixteenths:
-
-            # Test if the harmony at this sixteenth note moment in time is in chord_types
-            moment = fragment_v2.get(sixteenth.offset, .25)
-
-            pitchclasses = []
-            for inst_name in moment:
-                notes = moment[inst_name]
-                for note in notes:  # always going to be 0 or 1, I think
-                    if note and note.pitch != None:
-                        pitchclasses.append(note.pitch % 12)
-            pitchclasses = list(set(pitchclasses))
-            pitchclasses.sort()
-            pitchclasses = tuple([p - pitchclasses[0] for p in pitchclasses])
-
-            if pitchclasses in chord_types:
-                good = True
-            else:
-                good = False
-            goods.append(good)
-
-        if all(goods):
-            print instrument_transpositions
-            good_variations.append(fragment_v2)
-
-    return good_variations
-
 
 def main():
 
     while m.
     fragment = make_fragment(n_quarters)
 
-    good_variations = get_good_variations(fragment)
+    good_transpositions = fragment.find_transpositions(chord_table)
 
-    print 'Good variations:', len(good_variations)
+    print 'Good variations:', len(good_transpositions)
 
-    if len(good_variations) < 1:
+    if len(good_transpositions) < 1:
         return
 
     # instrument_register = {
@@ -336,21 +277,16 @@ def main():
     # }
 
 
-    for instrument in fragment.instruments:
-        for note in instrument.finalized_notes:
-            offsets = [0, 8, 16, 24]
-            for offset in offsets:
-                m.grid[instrument.part_id].put_note(note.offset + offset, note.duration, pitch=note.pitch, staccato=note.staccato)
+    offsets = [0, 8, 16, 24]
+    for offset in offsets:
+        m.put_fragment(offset, fragment)
 
 
     global_offset = 0
-    for variation in good_variations:
+    for variation in get_good_variations(fragment, good_transpositions):
         global_offset += 32
-        for instrument in variation.instruments:
-            for note in instrument.finalized_notes:
-                offsets = [0, 8, 16, 24]
-                for offset in offsets:
-                    m.grid[instrument.part_id].put_note(note.offset + offset + global_offset, note.duration, pitch=note.pitch, staccato=note.staccato)
+        for offset in offsets:
+            m.put_fragment(offset + global_offset, variation)
 
 
     m.closeout()
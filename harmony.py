@@ -0,0 +1,170 @@
+"""Pitch class sets and chord types as bit masks, with lookup tables of which ones are allowed.
+
+A set of pitch classes is encoded as a 12 bit mask, bit n meaning pitch class n
+is present. A voiced chord type (the intervals above the lowest pitch, which
+can be more than an octave) is encoded the same way with more bits.
+
+"""
+
+import numpy as np
+
+
+def pitch_class_mask(pitches):
+    '''Encode the pitch classes of a pitch, a chord (or any list of pitches) or a rest as a 12 bit mask
+
+    >>> pitch_class_mask(60)
+    1
+    >>> pitch_class_mask([60, 64, 79])
+    145
+    >>> pitch_class_mask(None)
+    0
+    '''
+    if pitches is None:
+        return 0
+    if not isinstance(pitches, (list, tuple)):
+        pitches = [pitches]
+    mask = 0
+    for p in pitches:
+        mask |= 1 << (p % 12)
+    return mask
+
+
+def pitch_classes(pitches):
+    '''The distinct pitch classes of a pitch or a chord, in order
+
+    >>> pitch_classes([67, 60, 72])
+    [0, 7]
+    '''
+    if not isinstance(pitches, (list, tuple)):
+        pitches = [pitches]
+    return sorted(set(p % 12 for p in pitches))
+
+
+def interval_mask(pitches):
+    '''Encode the intervals above the lowest of `pitches` as a mask
+
+    >>> interval_mask([72, 60, 67])
+    4225
+    >>> mask_to_tuple(interval_mask([72, 60, 67]))
+    (0, 7, 12)
+    '''
+    lowest = min(pitches)
+    mask = 0
+    for p in pitches:
+        mask |= 1 << (p - lowest)
+    return mask
+
+
+def mask_to_tuple(mask):
+    '''
+    >>> mask_to_tuple(145)
+    (0, 4, 7)
+    >>> mask_to_tuple(0)
+    ()
+    '''
+    result = []
+    n = 0
+    while mask:
+        if mask & 1:
+            result.append(n)
+        mask >>= 1
+        n += 1
+    return tuple(result)
+
+
+def tuple_to_mask(chord):
+    '''
+    >>> tuple_to_mask((0, 4, 7))
+    145
+    '''
+    mask = 0
+    for p in chord:
+        mask |= 1 << p
+    return mask
+
+
+def rotate(masks, n):
+    '''Transpose (arrays of) pitch class masks by `n` semitones, which can also be an array
+
+    >>> rotate(145, 5)
+    545
+    >>> mask_to_tuple(rotate(145, 7))
+    (2, 7, 11)
+    '''
+    n = np.mod(n, 12)
+    return ((masks << n) | (masks >> (12 - n))) & 0xfff
+
+
+class ChordTable(object):
+    def __init__(self, chord_types, n_bits=12, normalize=True):
+        """Precomputed facts about every mask of `n_bits` bits
+
+            `chord_types`: the allowed chord types, either a list of tuples or a
+                           dict of tuples to weights
+            `normalize`:   If True, a mask is allowed if its chord type (its
+                           members minus the lowest member) is one of
+                           `chord_types`. If False, the mask itself has to be
+                           one of `chord_types`.
+
+            Only tuples in sorted order (and, if `normalize`, starting at 0)
+            can ever match, the same as testing a sorted tuple for membership
+            in `chord_types`.
+
+            For each mask, `allowed`, `weights`, `roots` (the lowest member, or
+            -1 if empty) and `chord_types` (the mask shifted down to its root)
+            can be looked up with one array index.
+
+        >>> table = ChordTable({(0, 4, 7): 2.0, (0, 3, 7): 1.0, (4, 7, 12): 5.0})
+        >>> table.is_allowed(pitch_class_mask([62, 66, 69])), table.weight(pitch_class_mask([62, 66, 69]))
+        (True, 2.0)
+        >>> table.is_allowed(tuple_to_mask((4, 7, 12)))
+        False
+        >>> table.roots[pitch_class_mask([62, 66, 69])]
+        2
+        >>> table.is_allowed(1 << 20)
+        False
+        """
+        if not isinstance(chord_types, dict):
+            chord_types = {chord_type: 1.0 for chord_type in chord_types}
+
+        self.n_bits = n_bits
+        self.size = 2 ** n_bits
+        self.normalize = normalize
+
+        masks = np.arange(self.size)
+        lowest_bits = masks & -masks
+        self.roots = np.full(self.size, -1, dtype=np.int8)
+        self.roots[1:] = np.log2(lowest_bits[1:]).round().astype(np.int8)
+        self.chord_types = masks >> np.maximum(self.roots, 0)
+
+        allowed = np.zeros(self.size, dtype=bool)
+        weights = np.zeros(self.size)
+        for chord_type, weight in chord_types.items():
+            if list(chord_type) != sorted(set(chord_type)):
+                continue
+            if normalize and chord_type and chord_type[0] != 0:
+                continue
+            mask = tuple_to_mask(chord_type)
+            if mask < self.size:
+                allowed[mask] = True
+                weights[mask] = weight
+
+        if normalize:
+            # Look every mask up by its chord type
+            allowed = allowed[self.chord_types]
+            weights = weights[self.chord_types]
+        self.allowed = allowed
+        self.weights = weights
+
+    def is_allowed(self, mask):
+        return 0 <= mask < self.size and bool(self.allowed[mask])
+
+    def weight(self, mask):
+        if 0 <= mask < self.size:
+            return self.weights[mask]
+        return 0.0
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
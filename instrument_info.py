@@ -0,0 +1,61 @@
+"""Facts about each instrument in instrument_data, worked out once per instrument.
+
+>>> info = get_instrument_info('oboe')
+>>> info.abbreviation, info.lowest_note, info.highest_note
+('ob', 58, 90)
+>>> info.middle_register
+[72, 73, 74, 75, 76]
+>>> get_instrument_info('oboe') is info
+True
+
+"""
+
+import numpy as np
+
+from instrument_data import instrument_data
+from utils import split_list, flatten
+
+
+class InstrumentInfo(object):
+    def __init__(self, instrument_name, n_chunks=7):
+        """The name, abbreviation, range and registers of an instrument
+
+            The range is divided into `n_chunks` registers. Everything here is
+            shared by every Instrument of this kind, so don't change it.
+
+        """
+        data = instrument_data[instrument_name]
+        self.instrument_name = instrument_name
+        self.name = data['name']
+        self.abbreviation = data['abbreviation']
+
+        self.range = data['range']
+        self.range_array = np.array(self.range)
+        self.range_array.setflags(write=False)
+        self.lowest_note = self.range[0]
+        self.highest_note = self.range[-1]
+
+        self.registers = list(split_list(self.range, n_chunks=n_chunks))
+        self.middle_register = self.registers[3]  # assuming 7 divisions
+        self.highest_register = self.registers[-1]
+        self.lowest_register = self.registers[0]
+        self.safe_register = flatten(self.registers[1:-1])
+        self.very_safe_register = flatten(self.registers[2:-2])
+
+    def __repr__(self):
+        return '<InstrumentInfo: {}>'.format(self.instrument_name)
+
+
+_registry = {}
+
+
+def get_instrument_info(instrument_name, n_chunks=7):
+    key = (instrument_name, n_chunks)
+    if key not in _registry:
+        _registry[key] = InstrumentInfo(instrument_name, n_chunks=n_chunks)
+    return _registry[key]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
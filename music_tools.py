@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 
 import math
+from bisect import bisect_left, bisect_right, insort
+from itertools import izip
 
 from notation_tools import Notation
-from instrument_data import instrument_data
-import utils
+from instrument_info import get_instrument_info
+from harmony import ChordTable, pitch_class_mask
 
 
 def range16ths(start, end, step=.25):
@@ -96,10 +98,11 @@ def make_allowed_harmonies():
 
 
 allowed_harmonies = make_allowed_harmonies()
+allowed_harmonies_table = ChordTable(allowed_harmonies, normalize=False)
 
 
 def is_harmony_allowed(pitches):
-    return tuple(pitches_to_pitchclasses(pitches)) in allowed_harmonies
+    return allowed_harmonies_table.is_allowed(pitch_class_mask(pitches))
 
 
 def get_intervals(pitches):
@@ -114,16 +117,67 @@ class Tick(object):
         self.bar_number, self.beat_within_bar, self.position_within_beat = meter_position(tick)
 
 
+def is_pitched(pitch):
+    # A pitch can be 0, or a non-empty chord
+    return isinstance(pitch, int) or (isinstance(pitch, list) and pitch)
+
+
 class Note(object):
     def __init__(self, pitch=None, duration=0.0):
-        self.pitch = pitch
-        self.duration = duration
+        # The Instrument this Note is in keeps running totals, so it needs to
+        # know when `pitch` or `duration` change
+        self._instrument = None
+        self._index = None
+
+        self._pitch = pitch
+        self._duration = duration
+
+    @property
+    def pitch(self):
+        return self._pitch
+
+    @pitch.setter
+    def pitch(self, pitch):
+        old_pitch = self._pitch
+        self._pitch = pitch
+        if self._instrument is not None:
+            self._instrument._pitch_changed(self._index, old_pitch, pitch)
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @duration.setter
+    def duration(self, duration):
+        self._duration = duration
+        if self._instrument is not None:
+            self._instrument._duration_changed(self._index)
 
     def __repr__(self):
         return '<Note - pitch: {} duration: {}>'.format(self.pitch, self.duration)
 
 
+def _reindexing(method):
+    '''Wrap a list method that can change an Instrument's notes arbitrarily so the Instrument is reindexed afterwards'''
+    def wrapper(self, *args, **kwargs):
+        notes = list(self)
+        result = method(self, *args, **kwargs)
+        # Notes that were taken out are free to go in another Instrument
+        for note in notes:
+            note._instrument = None
+        self._reindex()
+        return result
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
 class Instrument(list):
+    '''The notes of one part, in order
+
+    A Note can only be in one Instrument at a time, because the Instrument
+    keeps track of where it is. Take it out of one before putting it in
+    another.
+    '''
     def __init__(self, part_name):
         self.part_name = part_name
         self.part_id = part_name
@@ -136,32 +190,100 @@ class Instrument(list):
             self.instrument_number = int(name_chunks[-1])  # if more than one of the same instrument
             self.part_id = part_name.replace(' ', '_')
 
-        self.abbreviation = instrument_data[self.instrument_name]['abbreviation']
+        self.abbreviation = get_instrument_info(self.instrument_name).abbreviation
         self.abbreviation_id = self.abbreviation
         if self.instrument_number > 1:
             self.abbreviation_id = '{}{}'.format(self.abbreviation, self.instrument_number)
             self.abbreviation = '{} {}'.format(self.abbreviation, self.instrument_number)
 
-        self.range = instrument_data[self.instrument_name]['range']
+        self.range = get_instrument_info(self.instrument_name).range
         self._make_registers()
 
+        self._reindex()
+
     def __repr__(self):
         return '<music_tools.Instrument: {}>'.format(self.part_name)
 
-    def _make_registers(self, n_chunks=7):
-        self.lowest_note = self.range[0]
-        self.highest_note = self.range[-1]
+    def _reindex(self):
+        # The offset of each note (computed lazily, see `_update_offsets`), and
+        # the indexes of the rests and of the pitched notes
+        self._offsets = []
+        self._rest_indexes = []
+        self._pitched_indexes = []
+        for index, note in enumerate(self):
+            self._index_note(index, note)
+
+    def _index_note(self, index, note):
+        if note._instrument is not None and note._instrument is not self:
+            raise ValueError('{} is already in {}'.format(note, note._instrument))
+        note._instrument = self
+        note._index = index
+        indexes = self._get_pitch_indexes(note.pitch)
+        if indexes is not None:
+            indexes.append(index)
+
+    def _get_pitch_indexes(self, pitch):
+        # The list of indexes that a note with this pitch belongs in, if any
+        if pitch == 'rest':
+            return self._rest_indexes
+        if is_pitched(pitch):
+            return self._pitched_indexes
+
+    def _pitch_changed(self, index, old_pitch, pitch):
+        # Only move this one note's index, if it changes lists
+        old_indexes = self._get_pitch_indexes(old_pitch)
+        indexes = self._get_pitch_indexes(pitch)
+        if old_indexes is indexes:
+            return
+        if old_indexes is not None:
+            del old_indexes[bisect_left(old_indexes, index)]
+        if indexes is not None:
+            insort(indexes, index)
+
+    def _duration_changed(self, index):
+        # Only the offsets of the notes after this one move
+        del self._offsets[index + 1:]
+
+    def _update_offsets(self):
+        offsets = self._offsets
+        if self and not offsets:
+            offsets.append(0)
+        for index in xrange(len(offsets), len(self)):
+            offsets.append(offsets[-1] + self[index - 1].duration)
+
+    def append(self, note):
+        self._index_note(len(self), note)
+        list.append(self, note)
+
+    extend = _reindexing(list.extend)
+    insert = _reindexing(list.insert)
+    pop = _reindexing(list.pop)
+    remove = _reindexing(list.remove)
+    sort = _reindexing(list.sort)
+    reverse = _reindexing(list.reverse)
+    __setitem__ = _reindexing(list.__setitem__)
+    __delitem__ = _reindexing(list.__delitem__)
+    __setslice__ = _reindexing(list.__setslice__)
+    __delslice__ = _reindexing(list.__delslice__)
+    __iadd__ = _reindexing(list.__iadd__)
 
-        registers = list(utils.split_list(self.range, n_chunks=n_chunks))
+    def _make_registers(self, n_chunks=7):
+        # Worked out once per kind of instrument and shared
+        info = get_instrument_info(self.instrument_name, n_chunks=n_chunks)
+        self.lowest_note = info.lowest_note
+        self.highest_note = info.highest_note
 
-        self.middle_register = registers[3]  # assuming 7 divisions
-        self.highest_register = registers[-1]
-        self.lowest_register = registers[0]
-        self.safe_register = utils.flatten(registers[1:-1])
-        self.very_safe_register = utils.flatten(registers[2:-2])
+        self.middle_register = info.middle_register
+        self.highest_register = info.highest_register
+        self.lowest_register = info.lowest_register
+        self.safe_register = info.safe_register
+        self.very_safe_register = info.very_safe_register
 
     def duration(self):
-        return sum([note.duration for note in self])
+        if not self:
+            return 0
+        self._update_offsets()
+        return self._offsets[-1] + self[-1].duration
 
     def get_tick(self):
         return Tick(self.duration())
@@ -169,27 +291,45 @@ class Instrument(list):
     def add_note(self, pitch=None, duration=0.0):
         self.append(Note(pitch=pitch, duration=duration))
 
+    def get_offset(self, index):
+        self._update_offsets()
+        return self._offsets[index]
+
     def get_at_tick(self, tick):
-        duration = 0
-        for note in self:
-            if duration <= tick < duration + note.duration:
+        self._update_offsets()
+        index = bisect_right(self._offsets, tick) - 1
+        if index >= 0:
+            note = self[index]
+            if tick < self._offsets[index] + note.duration:
                 return note
-            duration += note.duration
 
-    def beats_since_last_rest(self, rest_duration=1):
-        duration = 0.0
-        for note in reversed(self):
-            duration += note.duration
-            if note.pitch is 'rest':
-                if note.duration >= rest_duration:
+    def iter_at_ticks(self, ticks):
+        '''Yield the note (or None) at each of `ticks`, which must be in ascending order, in one pass over the notes'''
+        notes = iter(self)
+        note = None
+        start = end = 0
+        for tick in ticks:
+            while end <= tick:
+                note = next(notes, None)
+                if note is None:
                     break
-        return duration
+                start, end = end, end + note.duration
+            if note is not None and start <= tick < end:
+                yield note
+            else:
+                yield None
+
+    def beats_since_last_rest(self, rest_duration=1):
+        '''The duration from the start of the last rest at least `rest_duration` long (or from the beginning) to the end'''
+        end = self.duration()
+        for index in reversed(self._rest_indexes):
+            if self[index].duration >= rest_duration:
+                return float(end - self._offsets[index])
+        return float(end)
 
     def get_last_pitched(self):
-        for note in reversed(self):
-            # Check if it's a note with a pitch (that can be 0, or a non-empty chord)
-            if isinstance(note.pitch, int) or (isinstance(note.pitch, list) and note.pitch):
-                return note
+        if self._pitched_indexes:
+            return self[self._pitched_indexes[-1]]
 
 
 class Music(object):
@@ -278,11 +418,35 @@ class Music(object):
             result[instrument.part_id] = instrument.get_at_tick(tick)
         return result
 
+    def iter_columns(self, resolution=1, instruments=None, reuse=False):
+        '''Yield a dict of the note each instrument is playing at every tick, like `get_at_tick`
+
+            `resolution`: the duration of a tick in quarters, eg .25 for sixteenths
+            `reuse`:      If True, the same dict is updated and yielded for
+                          every tick, so memory use doesn't grow with the
+                          length of the piece. Don't keep references to it.
+
+        Each instrument's notes are walked with one cursor, once.
+        '''
+        if instruments == None:
+            instruments = self.instruments
+        n_ticks = int(self.duration() / resolution)
+        columns = [instrument.iter_at_ticks(tick * resolution for tick in xrange(n_ticks)) for instrument in instruments]
+        part_ids = [instrument.part_id for instrument in instruments]
+
+        result = {}
+        for n in xrange(n_ticks):
+            if not reuse:
+                result = {}
+            result['tick'] = n * resolution
+            for part_id, column in izip(part_ids, columns):
+                result[part_id] = next(column)
+            yield result
+
     def __iter__(self):
-        for tick in range(int(self.duration())):
-            yield self.get_at_tick(tick)
+        return self.iter_columns()
 
-    def print_columns(self):
+    def print_columns(self, resolution=1):
         print
         print self.title, 'by', self.composer
         header = '{:<16}'.format('tick')
@@ -290,7 +454,7 @@ class Music(object):
             header += '{:<16}'.format(part_id)
         print header
 
-        for notes in self:
+        for notes in self.iter_columns(resolution=resolution, reuse=True):
             row = '{:<16}'.format(notes['tick'])
             for part_id in self.part_ids:
                 if notes[part_id] == None:
@@ -312,7 +476,13 @@ class Music(object):
 
         return result
 
-    def notate(self):
+    def notate(self, fmt=None, path=None, processes=None):
+        """Notate the music and open it in the notation app, or, if `fmt` is
+        given ('musicxml', 'mxl' or 'midi'), write it to a file instead
+
+            `processes`: if given, write the parts in parallel in a pool of this many processes
+
+        """
         self.notation = Notation(
             part_names=self.part_names,
             title=self.title,
@@ -326,7 +496,8 @@ class Music(object):
 
         for instrument in self.instruments:
             notation_instrument = self.notation.parts_by_name[instrument.part_name]
-            for note in instrument:
-                notation_instrument.add_note(note.pitch, note.duration)
+            notation_instrument.add_notes((note.pitch, note.duration) for note in instrument)
 
+        if fmt:
+            return self.notation.write(path=path, fmt=fmt, processes=processes)
         self.notation.show()
@@ -5,8 +5,7 @@ import math
 import numpy as np
 
 from notation_tools import Notation
-from instrument_data import instrument_data
-import utils
+from instrument_info import get_instrument_info
 from duration import Duration
 
 
@@ -14,17 +13,85 @@ def float_to_tick(flt, ticks_per_quarter=24):
     return int(round(float(flt) * ticks_per_quarter))
 
 
+# Bits in Timeline.flags
+NOTE_START = 1
+NOTE_END = 2
+
+
 class Tick(object):
-    def __init__(self, offset, timings, index):
-        self.offset = offset
+    """A read-only view of one tick in a Timeline"""
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent, index):
+        self.parent = parent
         self.index = index
 
-        self.quarters_offset, self.sixteenths_offset, self.remaining_ticks_offset = timings
+    @property
+    def offset(self):
+        return self.index
+
+    @property
+    def quarters_offset(self):
+        return self.parent.quarters_offsets[self.index].item()
+
+    @property
+    def sixteenths_offset(self):
+        return self.parent.sixteenths_offsets[self.index].item()
+
+    @property
+    def remaining_ticks_offset(self):
+        return self.parent.remaining_ticks_offsets[self.index].item()
+
+    @property
+    def note(self):
+        note_id = self.parent.note_ids[self.index]
+        if note_id >= 0:
+            return self.parent.notes[note_id]
+
+    @property
+    def note_start(self):
+        return bool(self.parent.flags[self.index] & NOTE_START)
+
+    @property
+    def note_end(self):
+        return bool(self.parent.flags[self.index] & NOTE_END)
+
+    @property
+    def pitch(self):
+        return self.parent.pitches[self.index]
+
+    def __repr__(self):
+        return '<Tick {} of {}>'.format(self.index, self.parent.n_ticks)
+
+
+class TickSpan(object):
+    """A contiguous run of ticks in a Timeline, from index `start` up to but not including `stop`"""
+    def __init__(self, parent, start, stop):
+        self.parent = parent
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        for index in xrange(self.start, self.stop):
+            yield Tick(self.parent, index)
 
-        self.note = None
-        self.note_start = False
-        self.note_end = False
-        self.pitch = None
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('tick index out of range')
+        return Tick(self.parent, self.start + index)
+
+    @property
+    def pitches(self):
+        return self.parent.pitches[self.start:self.stop]
+
+    def assign(self, note):
+        """Mark these ticks as belonging to `note`"""
+        self.parent.assign(self.start, self.stop, note)
 
 
 class Note(object):
@@ -33,13 +100,7 @@ class Note(object):
         self.duration = duration
 
         self.ticks = ticks
-
-        self.ticks[0].note_start = True
-        self.ticks[-1].note_end = True
-
-        for tick in self.ticks:
-            tick.note = self
-            tick.pitch = self.pitch
+        self.ticks.assign(self)
 
     def __repr__(self):
         return '<Note - pitch: {} duration: {}>'.format(self.pitch, self.duration)
@@ -50,56 +111,106 @@ class Timeline(object):
             n_quarters=64,
             ticks_per_quarter=24,
         ):
+        """A run of ticks, stored as arrays with one entry per tick
+
+            For each tick this keeps its offset as quarters, sixteenths and
+            remaining ticks, its pitch (None if it doesn't have one), the id
+            of the note on it (an index into `self.notes`, or -1 for no note)
+            and NOTE_START and NOTE_END flags. Indexing gives Tick views of
+            the arrays.
+
+        """
         self.ticks_per_quarter = ticks_per_quarter
         self.ticks_per_sixteenth = ticks_per_quarter / 4
         self.n_quarters = n_quarters
         self.n_sixteenths = n_quarters * 4
         self.n_ticks = ticks_per_quarter * n_quarters
 
-        self._timeline = []
-        for index, tick in enumerate(range(self.n_ticks)):
-            t = Tick(offset=tick, timings=self.ticks_to_quarters_and_sixteenths(tick), index=index)
-            self._timeline.append(t)
+        self.quarters_offsets, self.sixteenths_offsets, self.remaining_ticks_offsets = self.ticks_to_quarters_and_sixteenths(np.arange(self.n_ticks))
+
+        self.pitches = np.empty(self.n_ticks, dtype=object)
+        self.has_pitch = np.zeros(self.n_ticks, dtype=bool)
+        self.note_ids = np.full(self.n_ticks, -1, dtype=np.int32)
+        self.flags = np.zeros(self.n_ticks, dtype=np.uint8)
+        self.notes = []
 
     def __len__(self):
-        return len(self._timeline)
+        return self.n_ticks
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.n_ticks
+        if not 0 <= index < self.n_ticks:
+            raise IndexError('tick index out of range')
+        return Tick(self, index)
 
     def to_ticks(self, length_quarters, length_sixteenths):
         return (length_quarters * self.ticks_per_quarter) + (length_sixteenths * self.ticks_per_sixteenth)
 
     def ticks_to_quarters_and_sixteenths(self, ticks):
-        quarters, remainder = divmod(ticks, self.ticks_per_quarter)
-        sixteenths, remaining_ticks = divmod(remainder, self.ticks_per_sixteenth)
+        """Works on a tick or an array of ticks"""
+        quarters, remainder = np.divmod(ticks, self.ticks_per_quarter)
+        sixteenths, remaining_ticks = np.divmod(remainder, self.ticks_per_sixteenth)
         return quarters, sixteenths, remaining_ticks
 
+    def span(self, start, stop):
+        """The TickSpan from tick index `start` to `stop`, clipped to the Timeline like a list slice"""
+        start, stop, _ = slice(start, stop).indices(self.n_ticks)
+        return TickSpan(self, start, max(start, stop))
+
     def get(self, quarter, sixteenth=0, length_quarters=1, length_sixteenths=0):
         start = self.to_ticks(quarter, sixteenth)
         length = self.to_ticks(length_quarters, length_sixteenths)
         end = start + length
-        return self._timeline[start:end]
+        return self.span(start, end)
+
+    def _set_pitch(self, start, stop, pitch):
+        # Wrapped so that a chord (a list) is stored as one value in every tick
+        value = np.empty((), dtype=object)
+        value[()] = pitch
+        self.pitches[start:stop] = value
+        self.has_pitch[start:stop] = pitch is not None
 
     def fill(self, pitch, quarter, sixteenth=0, length_quarters=1, length_sixteenths=0):
         chunk = self.get(quarter, sixteenth=sixteenth, length_quarters=length_quarters, length_sixteenths=length_sixteenths)
-        for tick in chunk:
-            tick.pitch = pitch
+        self._set_pitch(chunk.start, chunk.stop, pitch)
 
     def check_if_clear(self, quarter, sixteenth=0, length_quarters=1, length_sixteenths=0):
         chunk = self.get(quarter, sixteenth=sixteenth, length_quarters=length_quarters, length_sixteenths=length_sixteenths)
-        return all([tick.pitch == None for tick in chunk])
+        return not self.has_pitch[chunk.start:chunk.stop].any()
 
-    def find_openings(self, duration):
-        # duration is in decimal quarter durations
-        openings = []
+    def assign(self, start, stop, note):
+        if start >= stop:
+            raise IndexError('A note needs at least one tick')
+        note_id = len(self.notes)
+        self.notes.append(note)
+
+        self.note_ids[start:stop] = note_id
+        self._set_pitch(start, stop, note.pitch)
+        self.flags[start] |= NOTE_START
+        self.flags[stop - 1] |= NOTE_END
 
+    def find_openings(self, length_quarters=1, length_sixteenths=0):
+        """Find every sixteenth where a note this long would only cover ticks without pitches
+
+            Returns a list of (quarter, sixteenth, length_quarters, length_sixteenths).
+        """
         n_starts = self.n_sixteenths - (length_quarters * 4) - length_sixteenths + 1
-        for sixteenth in range(n_starts):
-            quarter, sixteenth = divmod(sixteenth, 4)
-            clear = self.check_if_clear(quarter, sixteenth, length_quarters, length_sixteenths)
-            if clear:
-                openings.append((quarter, sixteenth, length_quarters, length_sixteenths))
-                # chunk = self.get(quarter, sixteenth, length_quarters, length_sixteenths)
-                # openings.append(chunk)
-        return openings
+        if n_starts <= 0:
+            return []
+
+        starts = np.arange(n_starts) * self.ticks_per_sixteenth
+        ends = np.minimum(starts + self.to_ticks(length_quarters, length_sixteenths), self.n_ticks)
+
+        # A start is clear if the number of ticks with pitches before its end is the same as before its start
+        n_pitched = np.concatenate(([0], np.cumsum(self.has_pitch)))
+        clear = np.flatnonzero(n_pitched[ends] == n_pitched[starts])
+
+        quarters, sixteenths = np.divmod(clear, 4)
+        return [
+            (quarter, sixteenth, length_quarters, length_sixteenths)
+            for quarter, sixteenth in zip(quarters.tolist(), sixteenths.tolist())
+        ]
 
     # def find_openings(self, length_quarters=1, length_sixteenths=0):
     #     openings = []
@@ -123,7 +234,7 @@ class Instrument(object):
 
         self._make_part_names(part_name)
 
-        self.range = instrument_data[self.instrument_name]['range']
+        self.range = get_instrument_info(self.instrument_name).range
         self._make_registers()
 
     def _make_part_names(self, part_name):
@@ -138,7 +249,7 @@ class Instrument(object):
             self.instrument_number = int(name_chunks[-1])  # if more than one of the same instrument
             self.part_id = part_name.replace(' ', '_')
 
-        self.abbreviation = instrument_data[self.instrument_name]['abbreviation']
+        self.abbreviation = get_instrument_info(self.instrument_name).abbreviation
         self.abbreviation_id = self.abbreviation
         if self.instrument_number > 1:
             self.abbreviation_id = '{}{}'.format(self.abbreviation, self.instrument_number)
@@ -148,16 +259,16 @@ class Instrument(object):
         return '<music_tools.Instrument: {}>'.format(self.part_name)
 
     def _make_registers(self, n_chunks=7):
-        self.lowest_note = self.range[0]
-        self.highest_note = self.range[-1]
+        # Worked out once per kind of instrument and shared
+        info = get_instrument_info(self.instrument_name, n_chunks=n_chunks)
+        self.lowest_note = info.lowest_note
+        self.highest_note = info.highest_note
 
-        registers = list(utils.split_list(self.range, n_chunks=n_chunks))
-
-        self.middle_register = registers[3]  # assuming 7 divisions
-        self.highest_register = registers[-1]
-        self.lowest_register = registers[0]
-        self.safe_register = utils.flatten(registers[1:-1])
-        self.very_safe_register = utils.flatten(registers[2:-2])
+        self.middle_register = info.middle_register
+        self.highest_register = info.highest_register
+        self.lowest_register = info.lowest_register
+        self.safe_register = info.safe_register
+        self.very_safe_register = info.very_safe_register
 
     # def add_note(self, pitch=None, duration=0.0):
     #     self.notes.append(Note(pitch=pitch, duration=duration))
@@ -167,7 +278,7 @@ class Instrument(object):
         duration_in_ticks = float_to_tick(duration, ticks_per_quarter=self.ticks_per_quarter)
         end_tick = start_tick + duration_in_ticks
 
-        ticks = self.timeline._timeline[start_tick:end_tick]
+        ticks = self.timeline.span(start_tick, end_tick)
 
         note = Note(pitch=pitch, duration=Duration(ticks=duration_in_ticks, ticks_per_quarter=self.ticks_per_quarter), ticks=ticks)
 
@@ -177,7 +288,7 @@ class Instrument(object):
         print 'length_sixteenths', length_sixteenths
 
         openings = []
-        for quarter, sixteenth, length_quarters, length_sixteenths in self.timeline.find_openings(length_sixteenths=length_sixteenths):
+        for quarter, sixteenth, length_quarters, length_sixteenths in self.timeline.find_openings(length_quarters=0, length_sixteenths=length_sixteenths):
             openings.append({
                 'start': quarter + (sixteenth * .25),
                 'duration': length_quarters + (length_sixteenths * .25)
@@ -186,21 +297,25 @@ class Instrument(object):
 
     def closeout(self):
         '''Put rests anywhere there aren't notes'''
-        rest_ticks = []
-        for i, tick in enumerate(self.timeline._timeline):
-            if tick.note:
-                if tick.note_start:
-                    if rest_ticks:
-                        # Add up the previous rest duration and append it to self.notes
-                        duration_in_ticks = len(rest_ticks)
-                        note = Note(duration=Duration(ticks=duration_in_ticks, ticks_per_quarter=self.ticks_per_quarter), ticks=rest_ticks)
-                        self.notes.append(note)
-
-                    self.notes.append(tick.note)
-                if tick.note_end:
-                    rest_ticks = []
-            else:
-                rest_ticks.append(tick)
+        timeline = self.timeline
+        empty = timeline.note_ids < 0
+
+        note_starts = np.flatnonzero(~empty & ((timeline.flags & NOTE_START) > 0))
+        notes = [timeline.notes[note_id] for note_id in timeline.note_ids[note_starts]]
+
+        # Run-length encode the empty ticks; each run becomes a rest
+        edges = np.diff(np.concatenate(([0], empty.view(np.int8), [0])))
+        rest_starts = np.flatnonzero(edges == 1).tolist()
+        rest_stops = np.flatnonzero(edges == -1).tolist()
+        rests = [
+            Note(duration=Duration(ticks=stop - start, ticks_per_quarter=self.ticks_per_quarter), ticks=timeline.span(start, stop))
+            for start, stop in zip(rest_starts, rest_stops)
+        ]
+
+        # Interleave the notes and rests in order
+        events = notes + rests
+        order = np.argsort(np.concatenate((note_starts, rest_starts)), kind='mergesort')
+        self.notes = [events[i] for i in order]
 
 
 class Music(object):
@@ -281,7 +396,13 @@ class Music(object):
                     line += '  '
             print line
 
-    def notate(self):
+    def notate(self, fmt=None, path=None, processes=None):
+        """Notate the music and open it in the notation app, or, if `fmt` is
+        given ('musicxml', 'mxl' or 'midi'), write it to a file instead
+
+            `processes`: if given, write the parts in parallel in a pool of this many processes
+
+        """
         self.notation = Notation(
             part_names=self.part_names,
             title=self.title,
@@ -295,7 +416,8 @@ class Music(object):
 
         for instrument in self.instruments:
             notation_instrument = self.notation.parts_by_name[instrument.part_name]
-            for note in instrument.notes:
-                notation_instrument.add_note(note.pitch, note.duration.float)
+            notation_instrument.add_notes((note.pitch, note.duration.float) for note in instrument.notes)
 
+        if fmt:
+            return self.notation.write(path=path, fmt=fmt, processes=processes)
         self.notation.show()
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
+from bisect import bisect_left, bisect_right
+import itertools
+
+import numpy as np
+
 from notation_tools import Notation
-from instrument_data import instrument_data
+from instrument_info import get_instrument_info
+from harmony import ChordTable, mask_to_tuple, pitch_class_mask, pitch_classes, rotate
 from utils import (
-    split_list,
-    flatten,
+    LazyList,
     scale as scale_value,
     subdivide_duration,
 )
@@ -38,6 +43,16 @@ class Section(object):
             self.duration)
 
 
+def get_spans(offsets, next_offsets, query_offsets, query_durations):
+    '''For each query offset and duration, the start and stop indexes of the
+    sections (with sorted `offsets` and `next_offsets`) happening between
+    offset and offset + duration'''
+    query_offsets = np.asarray(query_offsets)
+    starts = np.searchsorted(next_offsets, query_offsets, side='right')
+    stops = np.maximum(starts, np.searchsorted(offsets, query_offsets + query_durations, side='left'))
+    return starts, stops
+
+
 class Layer(list):
     def __init__(self, sections, duration_quarters):
         """
@@ -56,6 +71,11 @@ class Layer(list):
 
         self.durations, self.relative_durations = subdivide_duration(sections, self.duration_quarters)
 
+        # Sorted section boundaries for bisecting, and sections by start offset
+        self.offsets = []
+        self.next_offsets = []
+        self._by_offset = {}
+
         offset = 0
         index = 0
         for duration in self.durations:
@@ -68,26 +88,252 @@ class Layer(list):
                 relative_duration=self.relative_durations[index],
             )
             self.append(section)
+            self.offsets.append(section.offset)
+            self.next_offsets.append(section.next_offset)
+            self._by_offset.setdefault(section.offset, section)
             offset += duration
             index += 1
 
+        # The same boundaries as arrays, for looking up many offsets at once
+        self._starts = np.array(self.offsets)
+        self._next_starts = np.array(self.next_offsets)
+
     def get(self, offset, duration=.25):
         '''Get all the Sections in this Layer happening between offset and offset + duration, where both are quarter durations'''
         next_offset = offset + duration
-        result = []
-        for section in self:
-            if section.next_offset <= offset:
-                continue
-            if section.offset >= next_offset:
-                break
-            result.append(section)
-        return result
+        start = bisect_right(self.next_offsets, offset)
+        end = bisect_left(self.offsets, next_offset, lo=start)
+        return self[start:end]
+
+    def get_each(self, offsets, durations):
+        '''`get` for each of an array of offsets and durations, with the lookups done all at once'''
+        starts, stops = get_spans(self._starts, self._next_starts, offsets, durations)
+        return [self[start:stop] for start, stop in zip(starts.tolist(), stops.tolist())]
 
     def starts_at(self, offset):
         '''If a Section in this Layer starts at offset, return it.'''
-        for section in self:
-            if section.offset == offset:
-                return section
+        return self._by_offset.get(offset)
+
+    def onsets_at(self, offsets):
+        '''A bool array, True where a Section in this Layer starts at each of `offsets`'''
+        return np.in1d(offsets, self.offsets)
+
+
+class EqualLayer(LazyList, Layer):
+    def __init__(self, n_sections, duration_quarters):
+        """A Layer of `n_sections` equal Sections that are only made when they're needed
+
+            The offsets are kept in arrays, added up one section at a time
+            the same way Layer does so they're exactly the same, and Section
+            k is made from offset k. Iterating makes all the Sections.
+
+        """
+        self._init_lazy(n_sections)
+        self.duration_quarters = float(duration_quarters)
+        self.duration = scale_value(1, 0, n_sections, 0, self.duration_quarters)
+
+        self.offsets = np.zeros(n_sections)
+        self.offsets[1:] = np.cumsum(np.repeat(self.duration, n_sections - 1))
+        self.next_offsets = self.offsets + self.duration
+        self._starts = self.offsets
+        self._next_starts = self.next_offsets
+
+    @property
+    def durations(self):
+        return [self.duration] * self._length
+
+    @property
+    def relative_durations(self):
+        return [1] * self._length
+
+    def _make_item(self, index):
+        # Layer's first offset is the int 0
+        offset = self.offsets[index].item() if index else 0
+        return Section(offset, self.duration, index, self._length, self, relative_duration=1)
+
+    def get(self, offset, duration=.25):
+        '''Get all the Sections in this Layer happening between offset and offset + duration, where both are quarter durations'''
+        start = np.searchsorted(self.next_offsets, offset, side='right')
+        end = np.searchsorted(self.offsets, offset + duration, side='left')
+        return self[start:max(start, end)]
+
+    def starts_at(self, offset):
+        '''If a Section in this Layer starts at offset, return it.'''
+        index = np.searchsorted(self.offsets, offset)
+        if index < len(self.offsets) and self.offsets[index] == offset:
+            return self[index]
+
+
+# Bits in TickLayer.flags
+NOTE_START = 1
+NOTE_END = 2
+
+
+class Tick(object):
+    """A read-only view of one tick in a TickLayer"""
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent, index):
+        self.parent = parent
+        self.index = index
+
+    @property
+    def offset(self):
+        return self.parent.offsets[self.index].item()
+
+    @property
+    def duration(self):
+        return self.parent.duration
+
+    @property
+    def next_offset(self):
+        return self.parent.next_offsets[self.index].item()
+
+    @property
+    def of_n_sections(self):
+        return self.parent.n_ticks
+
+    @property
+    def note(self):
+        note_id = self.parent.note_ids[self.index]
+        if note_id >= 0:
+            return self.parent.notes[note_id]
+
+    @property
+    def note_start(self):
+        return bool(self.parent.flags[self.index] & NOTE_START)
+
+    @property
+    def note_end(self):
+        return bool(self.parent.flags[self.index] & NOTE_END)
+
+    @property
+    def pitch(self):
+        note = self.note
+        if note:
+            return note.pitch
+
+    def __repr__(self):
+        return '<Tick {} of {}, offset: {}, duration: {}>'.format(
+            self.index,
+            self.parent.n_ticks,
+            self.offset,
+            self.duration)
+
+
+class TickSpan(object):
+    """A contiguous run of ticks in a TickLayer, from index `start` up to but not including `stop`"""
+    def __init__(self, parent, start, stop):
+        self.parent = parent
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        for index in xrange(self.start, self.stop):
+            yield Tick(self.parent, index)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def assign(self, note):
+        """Mark these ticks as belonging to `note`"""
+        self.parent.assign(self.start, self.stop, note)
+
+
+class TickLayer(object):
+    def __init__(self, n_ticks, duration_quarters):
+        """Equal divisions of a duration, stored as arrays rather than as a list of Sections
+
+            `n_ticks`: the number of ticks
+            `duration_quarters`: the duration of the layer in quarter durations
+
+            For each tick this keeps the id of the note on it (an index into
+            `self.notes`, or -1 for no note), NOTE_START and NOTE_END flags, and
+            the note's pitch (the lowest pitch of a chord, or -1 for no pitch).
+            Indexing or iterating gives Tick views of the arrays.
+
+        """
+        self.n_ticks = n_ticks
+        self.duration_quarters = float(duration_quarters)
+        self.duration = self.duration_quarters / n_ticks
+
+        # Add up the offsets one tick at a time, the same way Layer does
+        self.offsets = np.zeros(n_ticks)
+        self.offsets[1:] = np.cumsum(np.repeat(self.duration, n_ticks - 1))
+        self.next_offsets = self.offsets + self.duration
+
+        self._init_notes()
+
+    def _init_notes(self):
+        self.note_ids = np.full(self.n_ticks, -1, dtype=np.int32)
+        self.flags = np.zeros(self.n_ticks, dtype=np.uint8)
+        self.pitches = np.full(self.n_ticks, -1, dtype=np.int16)
+        self.notes = []
+
+    def blank_copy(self):
+        '''A new TickLayer with no notes that shares this one's offsets'''
+        ticks = TickLayer.__new__(TickLayer)
+        ticks.n_ticks = self.n_ticks
+        ticks.duration_quarters = self.duration_quarters
+        ticks.duration = self.duration
+        ticks.offsets = self.offsets
+        ticks.next_offsets = self.next_offsets
+        ticks._init_notes()
+        return ticks
+
+    def __len__(self):
+        return self.n_ticks
+
+    def __iter__(self):
+        return iter(TickSpan(self, 0, self.n_ticks))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Tick(self, i) for i in xrange(*index.indices(self.n_ticks))]
+        if index < 0:
+            index += self.n_ticks
+        if not 0 <= index < self.n_ticks:
+            raise IndexError('tick index out of range')
+        return Tick(self, index)
+
+    def span(self, offset, duration=.25):
+        """Get the TickSpan of ticks happening between offset and offset + duration, where both are quarter durations"""
+        start = np.searchsorted(self.next_offsets, offset, side='right')
+        stop = max(start, np.searchsorted(self.offsets, offset + duration, side='left'))
+        return TickSpan(self, int(start), int(stop))
+
+    def get(self, offset, duration=.25):
+        """Get all the Ticks happening between offset and offset + duration, where both are quarter durations"""
+        return list(self.span(offset, duration))
+
+    def get_each(self, offsets, durations):
+        """`get` for each of an array of offsets and durations, with the lookups done all at once"""
+        starts, stops = get_spans(self.offsets, self.next_offsets, offsets, durations)
+        return [list(TickSpan(self, start, stop)) for start, stop in zip(starts.tolist(), stops.tolist())]
+
+    def starts_at(self, offset):
+        """If a Tick starts at offset, return it."""
+        index = np.searchsorted(self.offsets, offset)
+        if index < self.n_ticks and self.offsets[index] == offset:
+            return Tick(self, int(index))
+
+    def assign(self, start, stop, note):
+        note_id = len(self.notes)
+        self.notes.append(note)
+
+        pitch = note.pitch
+        if isinstance(pitch, (list, tuple)):
+            pitch = min(pitch) if pitch else None
+        if pitch is None:
+            pitch = -1
+
+        self.note_ids[start:stop] = note_id
+        self.pitches[start:stop] = pitch
+        self.flags[start] |= NOTE_START
+        self.flags[stop - 1] |= NOTE_END
 
 
 class Note(object):
@@ -113,13 +359,7 @@ class Note(object):
         self.next_offset = offset + duration
 
         self.ticks = ticks
-
-        self.ticks[0].note_start = True
-        self.ticks[-1].note_end = True
-
-        for tick in self.ticks:
-            tick.note = self
-            tick.pitch = self.pitch
+        self.ticks.assign(self)
 
         self.staccato = staccato
         self.tenuto = tenuto
@@ -135,14 +375,77 @@ class Note(object):
         return repr_string.format(self.offset, self.duration, self.pitch)
 
 
+# The articulation flags a Note can have, in the order of the bits in NoteArray.articulations
+ARTICULATIONS = ('staccato', 'tenuto', 'accent', 'falloff', 'plop', 'scoop', 'doit', 'breath_mark')
+
+
+class NoteArray(object):
+    def __init__(self, offsets, durations, pitches, articulations):
+        """An immutable sequence of notes stored as arrays, for placing the same notes many times
+
+            `offsets`, `durations`: in quarter durations
+            `pitches`: ints, tuples of ints for chords, or None for rests
+            `articulations`: one int per note, bit n set if the note has ARTICULATIONS[n]
+
+        """
+        self.offsets = np.array(offsets, dtype=float)
+        self.durations = np.array(durations, dtype=float)
+        self.pitches = tuple(tuple(p) if isinstance(p, list) else p for p in pitches)
+        self.articulations = np.array(articulations, dtype=np.uint8)
+        for array in (self.offsets, self.durations, self.articulations):
+            array.setflags(write=False)
+
+    @classmethod
+    def from_notes(cls, notes):
+        articulations = []
+        for note in notes:
+            bits = 0
+            for bit, name in enumerate(ARTICULATIONS):
+                if getattr(note, name):
+                    bits |= 1 << bit
+            articulations.append(bits)
+        return cls(
+            [note.offset for note in notes],
+            [note.duration for note in notes],
+            [note.pitch for note in notes],
+            articulations,
+        )
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __repr__(self):
+        return '<NoteArray: {} notes>'.format(len(self))
+
+
 class Instrument(object):
     def __init__(self, part_name):
-        self.closeout_has_run = False
-        self.notes = []
+        self._init_notes()
+
         self._make_part_names(part_name)
-        self.range = instrument_data[self.instrument_name]['range']
+        self.range = get_instrument_info(self.instrument_name).range
         self._make_registers()
 
+    def _init_notes(self):
+        self.closeout_has_run = False
+
+        # Notes are kept sorted by offset as they're put, with a parallel list
+        # of offsets to bisect on
+        self.notes = []
+        self._note_offsets = []
+        self._longest_note_duration = 0
+        self._last_note = None
+
+        # NoteArrays placed with `place` and not yet put as Notes, as (notes, offset, transposition)
+        self.placements = []
+
+    def blank_copy(self):
+        '''A new Instrument with no notes that shares this one's names, range and registers'''
+        instrument = Instrument.__new__(Instrument)
+        instrument.__dict__.update(self.__dict__)
+        instrument._init_notes()
+        return instrument
+
     def _make_part_names(self, part_name):
         self.part_name = part_name
         self.part_id = part_name
@@ -155,7 +458,7 @@ class Instrument(object):
             self.instrument_number = int(name_chunks[-1])  # if more than one of the same instrument
             self.part_id = part_name.replace(' ', '_')
 
-        self.abbreviation = instrument_data[self.instrument_name]['abbreviation']
+        self.abbreviation = get_instrument_info(self.instrument_name).abbreviation
         self.abbreviation_id = self.abbreviation
         if self.instrument_number > 1:
             self.abbreviation_id = '{}{}'.format(self.abbreviation, self.instrument_number)
@@ -165,16 +468,18 @@ class Instrument(object):
         return '<music_tools.Instrument: {}>'.format(self.part_name)
 
     def _make_registers(self, n_chunks=7):
-        self.lowest_note = self.range[0]
-        self.highest_note = self.range[-1]
-
-        self.registers = list(split_list(self.range, n_chunks=n_chunks))
-
-        self.middle_register = self.registers[3]  # assuming 7 divisions
-        self.highest_register = self.registers[-1]
-        self.lowest_register = self.registers[0]
-        self.safe_register = flatten(self.registers[1:-1])
-        self.very_safe_register = flatten(self.registers[2:-2])
+        # Worked out once per kind of instrument and shared
+        info = get_instrument_info(self.instrument_name, n_chunks=n_chunks)
+        self.lowest_note = info.lowest_note
+        self.highest_note = info.highest_note
+        self.registers = info.registers
+        self.range_array = info.range_array
+
+        self.middle_register = info.middle_register
+        self.highest_register = info.highest_register
+        self.lowest_register = info.lowest_register
+        self.safe_register = info.safe_register
+        self.very_safe_register = info.very_safe_register
 
     def append_note(
             self,
@@ -189,10 +494,11 @@ class Instrument(object):
             doit=False,
             breath_mark=False,
         ):
-        self.notes.sort(key=lambda x: x.next_offset)
-        last_note = self.notes[-1]
+        self.materialize()
+        if self._last_note is None:
+            raise IndexError('Can\'t append a note to an instrument with no notes')
         self.put_note(
-            last_note.next_offset,
+            self._last_note.next_offset,
             duration,
             pitch=pitch,
             staccato=staccato,
@@ -220,11 +526,11 @@ class Instrument(object):
             breath_mark=False,
         ):
         # offset and duration in quarter durations
-        ticks = self.ticks.get(offset, duration)
-        note = Note(
+        # Put pending placements first so notes are put in the order they were asked for
+        self.materialize()
+        self._put_note(
             offset,
             duration,
-            ticks,
             pitch=pitch,
             staccato=staccato,
             tenuto=tenuto,
@@ -235,65 +541,214 @@ class Instrument(object):
             doit=doit,
             breath_mark=breath_mark,
         )
-        self.notes.append(note)
-        # self.notes.sort(key=lambda x: x.offset)  Probably too expensive to run every time
+
+    def _put_note(self, offset, duration, pitch=None, **articulations):
+        ticks = self.ticks.span(offset, duration)
+        note = Note(offset, duration, ticks, pitch=pitch, **articulations)
+        self._insert_note(note)
+        self.occupied[ticks.start:ticks.stop] = True
+        if pitch is not None:
+            self.pitch_class_counts[ticks.start:ticks.stop, pitch_classes(pitch)] += 1
+
+    def place(self, notes, offset=0, transposition=0):
+        '''Put a NoteArray at `offset`, transposed by `transposition` semitones
+
+            Only a reference is kept; the notes are put (see `materialize`) the
+            next time something needs them.
+
+        '''
+        self.placements.append((notes, offset, transposition))
+
+    def materialize(self):
+        '''Put all the notes from the pending placements'''
+        placements = self.placements
+        self.placements = []
+        for notes, offset, transposition in placements:
+            offsets = (notes.offsets + offset).tolist()
+            articulations = notes.articulations.tolist()
+            for index, (note_offset, duration) in enumerate(zip(offsets, notes.durations.tolist())):
+                pitch = notes.pitches[index]
+                if isinstance(pitch, tuple):
+                    pitch = [p + transposition for p in pitch]
+                elif pitch is not None:
+                    pitch += transposition
+                bits = articulations[index]
+                flags = {name: bool(bits & (1 << bit)) for bit, name in enumerate(ARTICULATIONS)}
+                self._put_note(note_offset, duration, pitch=pitch, **flags)
+
+    def _insert_note(self, note):
+        index = bisect_right(self._note_offsets, note.offset)
+        self.notes.insert(index, note)
+        self._note_offsets.insert(index, note.offset)
+
+        if note.duration > self._longest_note_duration:
+            self._longest_note_duration = note.duration
+        if self._last_note is None or note.next_offset >= self._last_note.next_offset:
+            self._last_note = note
 
     def get(self, offset, duration=.25):
         '''Get all the notes in this instrument happening between offset and offset + duration, where both are quarter durations'''
-        self.notes.sort(key=lambda x: x.offset)
-
+        self.materialize()
         next_offset = offset + duration
-        result = []
-        for note in self.notes:
-            if note.next_offset <= offset:
-                continue
-            if note.offset >= next_offset:
-                break
-            result.append(note)
-        return result
-
-    def find_openings(self, duration, window_offset=0, window_duration=None):
+
+        # No note that overlaps the window can start earlier than the longest note's duration before it
+        start = bisect_left(self._note_offsets, offset - self._longest_note_duration)
+        end = bisect_left(self._note_offsets, next_offset, lo=start)
+        return [note for note in self.notes[start:end] if note.next_offset > offset]
+
+    def find_openings(self, duration, window_offset=0, window_duration=None, alignment=None):
+        '''Get the offsets of the ticks in the window where a note of `duration` would fit without overlapping any notes
+
+            `alignment`: if given, only return offsets that are multiples of `alignment`, eg .5 for offsets on eighth notes
+
+        '''
+        self.materialize()
         if window_duration == None:
             window_duration = self.ticks.duration_quarters
-        openings = []
-        ticks = self.ticks.get(window_offset, window_duration)
-        for tick in ticks:
-            if tick.offset + duration > window_duration:
-                break
-            candidate_location = self.get(tick.offset, duration)
-            if not candidate_location:
-                openings.append(tick.offset)
-        return openings
+        window_next_offset = window_offset + window_duration
+
+        # Every tick in the window is a candidate start
+        window = self.ticks.span(window_offset, window_duration)
+        start_indexes = np.arange(window.start, window.stop)
+        starts = self.ticks.offsets[window.start:window.stop]
+        next_offsets = starts + duration
+
+        # A candidate is clear if no occupied ticks lie between its first tick and the first tick at or after its end
+        end_indexes = np.searchsorted(self.ticks.offsets, next_offsets, side='left')
+        n_occupied = np.concatenate(([0], np.cumsum(self.occupied)))
+        clear = n_occupied[end_indexes] == n_occupied[start_indexes]
+
+        is_opening = clear & (next_offsets <= window_next_offset)
+        if alignment:
+            is_opening &= starts % alignment == 0
+
+        return starts[is_opening].tolist()
 
     def closeout(self):
         '''Put rests anywhere there aren't notes'''
-        self.finalized_notes = []
-
-        rest_ticks = []
-        for tick in self.ticks:
-            if tick.note:
-                if tick.note_start:
-                    if rest_ticks:
-                        # Add up the previous rest duration and append it to self.finalized_notes
-                        duration = sum([t.duration for t in rest_ticks])
-                        note = Note(rest_ticks[0].offset, duration, rest_ticks)
-                        self.finalized_notes.append(note)
-
-                    self.finalized_notes.append(tick.note)
-                if tick.note_end:
-                    rest_ticks = []
-            else:
-                rest_ticks.append(tick)
-
-        if rest_ticks:
-            # Add up the previous rest duration and append it to self.finalized_notes
-            duration = sum([t.duration for t in rest_ticks])
-            note = Note(rest_ticks[0].offset, duration, rest_ticks)
-            self.finalized_notes.append(note)
+        self.materialize()
+        ticks = self.ticks
+        empty = ticks.note_ids < 0
+
+        note_starts = np.flatnonzero(~empty & ((ticks.flags & NOTE_START) > 0))
+        notes = [ticks.notes[note_id] for note_id in ticks.note_ids[note_starts]]
+
+        # Run-length encode the empty ticks; each run becomes a rest
+        edges = np.diff(np.concatenate(([0], empty.view(np.int8), [0])))
+        rest_starts = np.flatnonzero(edges == 1)
+        rest_stops = np.flatnonzero(edges == -1)
+        rest_offsets = ticks.offsets[rest_starts].tolist()
+        rest_durations = ((rest_stops - rest_starts) * ticks.duration).tolist()
+        rests = [
+            Note(offset, duration, TickSpan(ticks, start, stop))
+            for offset, duration, start, stop in zip(rest_offsets, rest_durations, rest_starts.tolist(), rest_stops.tolist())
+        ]
+
+        # Interleave the notes and rests in order
+        events = notes + rests
+        order = np.argsort(np.concatenate((note_starts, rest_starts)), kind='mergesort')
+        self.finalized_notes = [events[i] for i in order]
 
         self.closeout_has_run = True
 
 
+class ContextIndex(object):
+    def __init__(self, instruments):
+        """Everything `Music.get_contexts` looks up, as arrays built once from
+        the instruments' notes
+
+            For each instrument, the offsets and next offsets of its notes in
+            order, the pitch class mask of each note, and their pitches
+            flattened into one array (a rest is -1, a chord has an entry per
+            pitch) with where each note's pitches start and how many it has.
+
+        """
+        self.note_offsets = []
+        self.note_next_offsets = []
+        self.longest_note_durations = []
+        self.note_masks = []
+        self.pitches = []
+        self.pitch_starts = []
+        self.pitch_counts = []
+        for instrument in instruments:
+            self.note_offsets.append(np.array(instrument._note_offsets, dtype=float))
+            self.note_next_offsets.append(np.array([note.next_offset for note in instrument.notes], dtype=float))
+            self.longest_note_durations.append(instrument._longest_note_duration)
+
+            pitches = []
+            counts = []
+            self.note_masks.append(np.array([pitch_class_mask(note.pitch) for note in instrument.notes], dtype=int))
+            for note in instrument.notes:
+                if isinstance(note.pitch, (list, tuple)):
+                    pitches.extend(note.pitch)
+                    counts.append(len(note.pitch))
+                else:
+                    pitches.append(-1 if note.pitch is None else note.pitch)
+                    counts.append(1)
+            counts = np.array(counts, dtype=int)
+            self.pitches.append(np.array(pitches, dtype=int))
+            self.pitch_counts.append(counts)
+            self.pitch_starts.append(np.cumsum(counts) - counts)
+
+    def get_note_indexes(self, row, offsets, durations):
+        """For the instrument in `row`, the indexes of the notes happening
+        between each offset and offset + duration, as an array of query
+        numbers and an array of note indexes, both in order"""
+        note_offsets = self.note_offsets[row]
+        next_offsets = offsets + durations
+
+        # No note that overlaps a window can start earlier than the longest note's duration before it
+        starts = np.searchsorted(note_offsets, offsets - self.longest_note_durations[row], side='left')
+        stops = np.maximum(starts, np.searchsorted(note_offsets, next_offsets, side='left'))
+
+        queries, indexes = expand_ranges(starts, stops)
+        overlapping = self.note_next_offsets[row][indexes] > offsets[queries]
+        return queries[overlapping], indexes[overlapping]
+
+    def get_pitch_class_masks(self, rows, offsets, durations):
+        """For each query, the pitch class mask of the notes that the
+        instruments other than the one in its row play between offset and
+        offset + duration"""
+        masks = np.zeros(len(offsets), dtype=int)
+        for row in range(len(self.note_offsets)):
+            queries, note_indexes = self.get_note_indexes(row, offsets, durations)
+            self.add_pitch_class_masks(masks, row, rows, queries, note_indexes)
+        return masks
+
+    def add_pitch_class_masks(self, masks, row, rows, queries, note_indexes):
+        """Add the pitch classes of the notes at `note_indexes` in the
+        instrument in `row` to the `masks` of their queries, except for
+        queries about that instrument"""
+        others = rows[queries] != row
+        np.bitwise_or.at(masks, queries[others], self.note_masks[row][note_indexes[others]])
+
+    def get_pitches(self, row, queries, note_indexes):
+        """The pitches of the notes at `note_indexes` in the instrument in
+        `row`, as an array of query numbers and an array of pitches"""
+        pitch_queries, pitch_indexes = expand_ranges(
+            self.pitch_starts[row][note_indexes],
+            self.pitch_starts[row][note_indexes] + self.pitch_counts[row][note_indexes],
+            queries,
+        )
+        return pitch_queries, self.pitches[row][pitch_indexes]
+
+
+def expand_ranges(starts, stops, labels=None):
+    '''Every index in each range from `starts` to `stops`, all at once, with
+    the label (by default the number) of the range each one came from
+
+    >>> labels, indexes = expand_ranges(np.array([2, 7, 5]), np.array([4, 7, 6]))
+    >>> labels.tolist(), indexes.tolist()
+    ([0, 0, 2], [2, 3, 5])
+    '''
+    lengths = stops - starts
+    if labels is None:
+        labels = np.arange(len(starts))
+    ends = np.cumsum(lengths)
+    indexes = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+    return np.repeat(labels, lengths), indexes
+
+
 class Music(object):
     def __init__(self,
             title='Title',
@@ -305,6 +760,7 @@ class Music(object):
         ):
 
         self.closeout_has_run = False
+        self.note_arrays = None
 
         self.output_dir_parent = output_dir_parent
         self.output_dir_name = output_dir_name
@@ -334,16 +790,27 @@ class Music(object):
         self.bpm = bpm
 
         self._init_meter()
+        self.metrical_hierarchy = self._init_metrical_hierarchy()
 
+        # Every instrument's TickLayer shares the same offsets
+        ticks = self._make_ticks()
         for instrument in self.instruments:
             instrument.n_quarters = n_quarters
 
-            instrument.ticks = self.add_layer(instrument.part_id + '_ticks', self.n_sixteenths)
-            for tick in instrument.ticks:
-                tick.note = None
-                tick.note_start = False
-                tick.note_end = False
-                tick.pitch = None
+            ticks_name = instrument.part_id + '_ticks'
+            instrument.ticks = self.layers[ticks_name] = ticks.blank_copy()
+            setattr(self, ticks_name, instrument.ticks)
+
+            # Which ticks have notes put on them, for finding openings
+            instrument.occupied = np.zeros(len(instrument.ticks), dtype=bool)
+            # How many notes put on each tick have each pitch class, for harmonic context
+            instrument.pitch_class_counts = np.zeros((len(instrument.ticks), 12), dtype=np.int16)
+
+        self._context_index = None
+        self._context_index_key = None
+
+    def _make_ticks(self):
+        return TickLayer(self.n_sixteenths, self.n_quarters)
 
     def _setup_parts(self):
         # Instantiate instruments/parts and make them accessible via Music
@@ -351,7 +818,7 @@ class Music(object):
         self.grid = {}
         self.part_ids = []
         for part_name in self.part_names:
-            instrument = Instrument(part_name)
+            instrument = self._make_instrument(part_name)
 
             self.part_ids.append(instrument.part_id)
             setattr(self, instrument.part_id, instrument)
@@ -359,6 +826,9 @@ class Music(object):
             self.instruments.append(instrument)
             self.grid[instrument.part_id] = instrument
 
+    def _make_instrument(self, part_name):
+        return Instrument(part_name)
+
     def print_registers(self):
         lowest = min([i.range[0] for i in self.instruments])
         highest = max([i.range[-1] for i in self.instruments])
@@ -386,9 +856,16 @@ class Music(object):
         for i in self.instruments:
             i.closeout()
         self.closeout_has_run = True
+        self.note_arrays = None
         # print 'Done making the music.'
 
-    def notate(self):
+    def notate(self, fmt=None, path=None, processes=None):
+        """Notate the music and open it in the notation app, or, if `fmt` is
+        given ('musicxml', 'mxl' or 'midi'), write it to a file instead
+
+            `processes`: if given, write the parts in parallel in a pool of this many processes
+
+        """
         print 'Making notation...'
         self.notation = Notation(
             part_names=self.part_names,
@@ -403,10 +880,96 @@ class Music(object):
 
         for instrument in self.instruments:
             notation_instrument = self.notation.parts_by_name[instrument.part_name]
+            notation_instrument.add_notes(
+                (note.pitch, note.duration, tuple(name for name in ARTICULATIONS if getattr(note, name)))
+                for note in instrument.finalized_notes
+            )
+
+        if fmt:
+            path = self.notation.write(path=path, fmt=fmt, processes=processes)
+            print 'Wrote {}'.format(path)
+        else:
+            self.notation.show()
+        print 'Done making notation.'
+        return path
+
+    def get(self, offset, duration=.25):
+        return {i.part_id:i.get(offset, duration=duration) for i in self.instruments}
+
+    def pitch_class_matrix(self):
+        '''Get the pitch classes put in each instrument at each sixteenth, as
+        an array of pitch class masks with a row per instrument'''
+        for instrument in self.instruments:
+            instrument.materialize()
+        counts = np.array([instrument.pitch_class_counts for instrument in self.instruments])
+        return (counts > 0).dot(1 << np.arange(12)).astype(np.int32)
+
+    def find_transpositions(self, chord_types, transpositions=(-2, -1, 0, 1, 2), allow_parallel=False, block_size=4096):
+        '''Find every combination of per-instrument transpositions after which
+        the harmony at each sixteenth is one of `chord_types` (a list of chord
+        types or a harmony.ChordTable)
+
+            The combinations are tested against the pitch class matrix
+            `block_size` at a time, without building any Music, so memory
+            doesn't grow with the number of combinations. Unless
+            `allow_parallel`, combinations transposing every instrument by the
+            same interval are skipped. They're returned in the order of
+            itertools.product.
+
+        '''
+        if not isinstance(chord_types, ChordTable):
+            chord_types = ChordTable(chord_types)
+
+        transpositions = np.array(transpositions, dtype=np.int32)
+        n_transpositions = len(transpositions)
+        n_instruments = len(self.instruments)
+
+        # Each instrument's masks under each transposition: (instrument, transposition, sixteenth)
+        matrix = self.pitch_class_matrix()
+        rotated = rotate(matrix[:, np.newaxis], transpositions[np.newaxis, :, np.newaxis])
+
+        # Combination number -> index into `transpositions` for each instrument, first instrument most significant
+        place_values = n_transpositions ** np.arange(n_instruments - 1, -1, -1)
+
+        good = []
+        n_candidates = n_transpositions ** n_instruments
+        for start in range(0, n_candidates, block_size):
+            ids = np.arange(start, min(start + block_size, n_candidates))
+            indexes = ids[:, np.newaxis] // place_values % n_transpositions
+            if not allow_parallel:
+                indexes = indexes[(indexes != indexes[:, :1]).any(axis=1)]
+
+            harmonies = np.zeros((len(indexes), matrix.shape[1]), dtype=rotated.dtype)
+            for instrument_index in range(n_instruments):
+                harmonies |= rotated[instrument_index, indexes[:, instrument_index]]
+
+            block_good = chord_types.allowed[harmonies].all(axis=1)
+            good.extend(tuple(candidate) for candidate in transpositions[indexes[block_good]].tolist())
+        return good
+
+    def transpose(self, transpositions, title=None, output_dir_name=None):
+        '''Make a new Music with each instrument's finalized notes transposed by the corresponding interval in `transpositions`'''
+        if not self.closeout_has_run:
+            self.closeout()
+
+        music = type(self)(
+            title=title or self.title,
+            part_names=self.part_names,
+            output_dir_parent=self.output_dir_parent,
+            output_dir_name=output_dir_name or self.output_dir_name,
+            n_quarters=self.n_quarters,
+            bpm=self.bpm,
+        )
+        for instrument, new_instrument, transposition in zip(self.instruments, music.instruments, transpositions):
             for note in instrument.finalized_notes:
-                notation_instrument.add_note(
-                    note.pitch,
+                pitch = None
+                if note.pitch != None:
+                    pitch = note.pitch + transposition
+
+                new_instrument.put_note(
+                    note.offset,
                     note.duration,
+                    pitch=pitch,
                     staccato=note.staccato,
                     tenuto=note.tenuto,
                     accent=note.accent,
@@ -416,17 +979,39 @@ class Music(object):
                     doit=note.doit,
                     breath_mark=note.breath_mark,
                 )
-
-        self.notation.show()
-        print 'Done making notation.'
-
-    def get(self, offset, duration=.25):
-        return {i.part_id:i.get(offset, duration=duration) for i in self.instruments}
+        music.closeout()
+        return music
 
     def put_note(self, part_id, offset, duration, pitch=None):
         instrument = self.grid[part_id]
         instrument.put_note(offset, duration, pitch=pitch)
 
+    def _get_context_index(self):
+        '''The ContextIndex of the notes put so far, rebuilt only after notes have been put'''
+        for instrument in self.instruments:
+            instrument.materialize()
+        key = tuple(len(instrument.notes) for instrument in self.instruments)
+        if key != self._context_index_key:
+            self._context_index = ContextIndex(self.instruments)
+            self._context_index_key = key
+        return self._context_index
+
+    def _get_rows(self, part_ids):
+        return np.array([self.part_ids.index(part_id) for part_id in part_ids.ravel()], dtype=int).reshape(part_ids.shape)
+
+    def get_pitch_class_masks(self, part_ids, offsets, durations):
+        '''For each (part_id, offset, duration), the pitch class mask of the
+        notes the other instruments play that overlap offset to offset +
+        duration. Any of the arguments can be a single value or an array.'''
+        part_ids, offsets, durations = np.broadcast_arrays(part_ids, offsets, durations)
+        rows = self._get_rows(part_ids)
+        masks = self._get_context_index().get_pitch_class_masks(
+            rows.ravel(),
+            offsets.ravel().astype(float),
+            durations.ravel().astype(float),
+        )
+        return masks.reshape(rows.shape)
+
     def get_context(self, part_id, offset, duration):
         '''Get all the things that are happening relative to a duration in an instrument.
 
@@ -434,31 +1019,87 @@ class Music(object):
             - Metrical layers
             - Other user-defined layers (e.g, form, harmonies, registers, etc)
         '''
-        notes_context = self.get(offset, duration)
-        layers_context = self.get_sections(offset, duration)
-
-        pitches = []
-        for inst in notes_context:
-            if inst == part_id:
-                continue
-            for note in notes_context[inst]:
-                if isinstance(note.pitch, (list, tuple)):
-                    for p in note.pitch:
-                        pitches.append(p)
-                else:
-                    pitches.append(note.pitch)
-        pitches.sort()
-        pitch_classes = sorted(list(set([p % 12 for p in pitches])))
-
-        analysis = {
-            'pitches': pitches,
-            'pitch_classes': pitch_classes,
-            # TODO: 'previous_note': , # previous note in this instrument
-            # TODO: 'next_note': , # next note in this instrument
-
+        return self.get_contexts([(part_id, offset, duration)])[0]
+
+    def get_contexts(self, queries):
+        '''`get_context` for each of a list of (part_id, offset, duration), with
+        the notes, sections and harmony looked up for all of them at once'''
+        part_ids, offsets, durations = [np.array(values) for values in zip(*queries)]
+        n_queries = len(queries)
+        context_index = self._get_context_index()
+        rows = self._get_rows(part_ids)
+
+        # Each instrument's notes for every query, and the pitches of the ones the query's own instrument isn't playing
+        notes_by_part = {}
+        masks = np.zeros(n_queries, dtype=int)
+        pitch_queries = []
+        pitch_values = []
+        for row, instrument in enumerate(self.instruments):
+            note_queries, note_indexes = context_index.get_note_indexes(row, offsets, durations)
+            bounds = np.searchsorted(note_queries, np.arange(n_queries + 1)).tolist()
+            note_indexes_list = note_indexes.tolist()
+            notes_by_part[instrument.part_id] = [
+                [instrument.notes[i] for i in note_indexes_list[bounds[q]:bounds[q + 1]]]
+                for q in range(n_queries)
+            ]
+
+            context_index.add_pitch_class_masks(masks, row, rows, note_queries, note_indexes)
+            others = rows[note_queries] != row
+            queries_, pitches = context_index.get_pitches(row, note_queries[others], note_indexes[others])
+            pitch_queries.append(queries_)
+            pitch_values.append(pitches)
+
+        pitch_queries = np.concatenate(pitch_queries)
+        pitch_values = np.concatenate(pitch_values)
+        order = np.lexsort((pitch_values, pitch_queries))
+        pitch_queries = pitch_queries[order]
+        pitch_values = [None if p == -1 else p for p in pitch_values[order].tolist()]
+        pitch_bounds = np.searchsorted(pitch_queries, np.arange(n_queries + 1)).tolist()
+
+        sections_by_layer = {
+            layer_name: layer.get_each(offsets, durations)
+            for layer_name, layer in self.layers.items()
         }
 
-        return notes_context, layers_context, analysis
+        contexts = []
+        for q, mask in enumerate(masks.tolist()):
+            notes_context = {part_id: notes[q] for part_id, notes in notes_by_part.items()}
+            layers_context = {layer_name: sections[q] for layer_name, sections in sections_by_layer.items()}
+
+            analysis = {
+                'pitches': pitch_values[pitch_bounds[q]:pitch_bounds[q + 1]],
+                'pitch_classes': list(mask_to_tuple(mask)),
+                'pitch_class_mask': mask,
+                # TODO: 'previous_note': , # previous note in this instrument
+                # TODO: 'next_note': , # next note in this instrument
+
+            }
+            contexts.append((notes_context, layers_context, analysis))
+        return contexts
+
+    def score_pitches(self, part_id, offset, duration, chord_table, pitches=None):
+        '''Score candidate pitches for a note in an instrument against what the other instruments are playing
+
+            `chord_table`: a harmony.ChordTable of allowed harmonies
+            `pitches`: the candidates, by default the instrument's range
+
+            Returns the candidates as an array, with a boolean array of which
+            would make an allowed harmony and an array of their weights. The
+            harmony is the candidate with the pitch classes of the other
+            instruments' notes that overlap offset to offset + duration
+            (`get_pitch_class_masks`, the same as `get_contexts` uses), so
+            notes off the sixteenth grid count only where they really sound.
+
+            `offset` can also be an array of offsets (eg all the openings
+            from `find_openings`), in which case the boolean and weight arrays
+            have a row per offset.
+        '''
+        if pitches is None:
+            pitches = self.grid[part_id].range_array
+        pitches = np.asarray(pitches)
+        context_masks = self.get_pitch_class_masks(part_id, offset, duration)
+        masks = np.asarray(context_masks)[..., np.newaxis] | (1 << (pitches % 12))
+        return pitches, chord_table.allowed[masks], chord_table.weights[masks]
 
     def _init_meter(self):
         self.quarter_duration_seconds = 60.0 / self.bpm
@@ -485,7 +1126,15 @@ class Music(object):
         self.meter_layers = [self.bars, self.halves, self.quarters, self.eighths, self.sixteenths]
 
     def add_layer(self, name, sections):
-        layer = Layer(sections, self.n_quarters)
+        if isinstance(sections, int):
+            layer = EqualLayer(sections, self.n_quarters)
+        else:
+            layer = Layer(sections, self.n_quarters)
+
+        # Which sixteenths each Section starts on, for building metrical hierarchies
+        sixteenths = layer if name == 'sixteenths' else self.sixteenths
+        layer.onsets = layer.onsets_at(sixteenths.offsets)
+
         self.layers[name] = layer
         setattr(self, name, layer)
         return layer
@@ -504,28 +1153,101 @@ class Music(object):
                 results.append(found)
         return results
 
-    def build_metrical_hierarchy(self):
-        rankings = []
-        for sixteenth in self.sixteenths:
-            depth = 5
-            for layer in self.meter_layers:
-                found = layer.starts_at(sixteenth.offset)
-                if found:
-                    depth -= 1
-            rankings.append(depth)
-        return rankings
-
-    def put_fragment(self, offset, fragment, instruments=None):
+    def _init_metrical_hierarchy(self):
+        if self.n_quarters % 4:
+            # The bars don't line up with the sixteenths, so look at where they actually start
+            return self.build_metrical_hierarchy()
+
+        # In 4/4, a sixteenth starts a bar, half, quarter or eighth if its index is divisible by 16, 8, 4 or 2
+        sixteenths = np.arange(self.n_sixteenths)
+        depths = np.full(self.n_sixteenths, len(self.meter_layers), dtype=np.int8)
+        for sixteenths_per_section in [16, 8, 4, 2, 1]:
+            depths -= sixteenths % sixteenths_per_section == 0
+        return depths
+
+    def build_metrical_hierarchy(self, layers=None):
+        '''The depth of each sixteenth in a hierarchy of `layers` (by default
+        the meter layers): how many of the layers don't have a Section
+        starting on it. Any layers made with `add_layer` can be included.'''
+        if layers is None:
+            layers = self.meter_layers
+        n_onsets = np.sum([layer.onsets for layer in layers], axis=0)
+        return (len(layers) - n_onsets).astype(np.int8)
+
+    def get_metrical_depth(self, offset):
+        return self.metrical_hierarchy[int(offset * 4)]
+
+    def get_note_arrays(self):
+        '''Each instrument's finalized notes as a NoteArray, by part_id, made once after closeout'''
+        if not self.closeout_has_run:
+            self.closeout()
+        if self.note_arrays is None:
+            self.note_arrays = {
+                instrument.part_id: NoteArray.from_notes(instrument.finalized_notes)
+                for instrument in self.instruments
+            }
+        return self.note_arrays
+
+    def put_fragment(self, offset, fragment, instruments=None, transposition=0):
+        '''Place the notes of `fragment` (a closed out Music) at `offset` without copying them'''
         if not instruments:
             instruments = fragment.instruments
+        note_arrays = fragment.get_note_arrays()
         for instrument in instruments:
-            for note in instrument.finalized_notes:
-                self.grid[instrument.part_id].put_note(
-                    note.offset + offset,
-                    note.duration,
-                    pitch=note.pitch,
-                    staccato=note.staccato
-                )
+            self.grid[instrument.part_id].place(note_arrays[instrument.part_id], offset, transposition)
+
+
+class Fragment(Music):
+    """A Music for short fragments that are made by the hundred
+
+    Every Fragment with the same duration and bpm shares one set of meter
+    layers, and every instrument with the same part name shares its names,
+    range and registers, so making a Fragment only allocates its notes.
+    The shared meter layers shouldn't be changed; layers added with
+    `add_layer` are a Fragment's own.
+
+    """
+    _meters = {}
+    _instruments = {}
+
+    def _get_meter(self):
+        key = (self.n_quarters, self.bpm)
+        if key not in Fragment._meters:
+            meter = Music(part_names=(), n_quarters=self.n_quarters, bpm=self.bpm)
+            meter.ticks = meter._make_ticks()
+            Fragment._meters[key] = meter
+        return Fragment._meters[key]
+
+    def _make_instrument(self, part_name):
+        if part_name not in Fragment._instruments:
+            Fragment._instruments[part_name] = Instrument(part_name)
+        return Fragment._instruments[part_name].blank_copy()
+
+    def _init_meter(self):
+        meter = self._get_meter()
+        for name in (
+                'quarter_duration_seconds',
+                'bar_duration_seconds',
+                'half_note_duration_seconds',
+                'eighth_note_duration_seconds',
+                'sixteenth_note_duration_seconds',
+                'n_bars',
+                'n_halves',
+                'n_eighths',
+                'n_sixteenths',
+                'duration_seconds',
+                'meter_layers',
+            ):
+            setattr(self, name, getattr(meter, name))
+        for name, layer in meter.layers.items():
+            self.layers[name] = layer
+            setattr(self, name, layer)
+
+    def _init_metrical_hierarchy(self):
+        return self._get_meter().metrical_hierarchy
+
+    def _make_ticks(self):
+        return self._get_meter().ticks
 
 
 if __name__ == '__main__':
@@ -1,46 +1,12 @@
 import datetime
 import os
-
-from music21 import environment
-from music21.metadata import Metadata
-from music21.stream import Score, Part
-from music21.tempo import MetronomeMark
-from music21.duration import Duration
-from music21.meter import TimeSignature
-from music21.note import Rest, Note
-from music21.pitch import Pitch
-from music21.chord import Chord
-from music21.instrument import (
-    Violin,
-    Flute,
-    Oboe,
-    Clarinet,
-    BassClarinet,
-    Saxophone,
-    Trumpet,
-    Bass,
-    Percussion,
-    EnglishHorn,
-    Recorder,
-    BaritoneSaxophone,
-    Guitar,
-    Organ,
-    Piano,
-    Vibraphone,
-)
-from music21.articulations import (
-    Staccato,
-    Tenuto,
-
-    Accent,
-
-    Falloff,  # An indeterminantSlide coming after the main note and going down.
-    Plop,     # An indeterminantSlide coming before the main note and going down.
-    Scoop,    # An indeterminantSlide coming before the main note and going up
-    Doit,     # An indeterminantSlide coming after the main note and going up.
-
-    BreathMark,
-)
+import re
+import subprocess
+import tempfile
+import zipfile
+from fractions import Fraction
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
 
 from instrument_data import instrument_data
 
@@ -63,11 +29,13 @@ def show(stream):
 
 
 def get_music21_user_settings_path():
+    from music21 import environment
     user_settings = environment.UserSettings()
     return user_settings.getSettingsPath()
 
 
 def print_music21_user_settings():
+    from music21 import environment
     for key in sorted(environment.keys()):
         try:
             value = environment.get(key)
@@ -76,28 +44,33 @@ def print_music21_user_settings():
         print '{:<25} {}'.format(key, value)
 
 
-instrument_classes = {
-    'violin': Violin,
-    'flute': Flute,
-    'oboe': Oboe,
-    'clarinet': Clarinet,
-    'bass_clarinet': BassClarinet,
-    'alto_saxophone': Saxophone,
-    'trumpet': Trumpet,
-    'bass': Bass,
-    'percussion': Percussion,
-    'english_horn': EnglishHorn,
-    'alto_recorder': Recorder,
-    'soprano_recorder': Recorder,
-    'baritone_saxophone': BaritoneSaxophone,
-    'guitar': Guitar,
-    'organ': Organ,
-    'piano': Piano,
-    'vibraphone': Vibraphone,
+# music21 is slow to import, so it's only imported by the functions that use it
+
+# Names of the music21.instrument classes
+instrument_class_names = {
+    'violin': 'Violin',
+    'flute': 'Flute',
+    'oboe': 'Oboe',
+    'clarinet': 'Clarinet',
+    'bass_clarinet': 'BassClarinet',
+    'alto_saxophone': 'Saxophone',
+    'trumpet': 'Trumpet',
+    'bass': 'Bass',
+    'percussion': 'Percussion',
+    'english_horn': 'EnglishHorn',
+    'alto_recorder': 'Recorder',
+    'soprano_recorder': 'Recorder',
+    'baritone_saxophone': 'BaritoneSaxophone',
+    'guitar': 'Guitar',
+    'organ': 'Organ',
+    'piano': 'Piano',
+    'vibraphone': 'Vibraphone',
 }
 
-for name in instrument_data:
-    instrument_data[name]['class'] = instrument_classes[name]
+
+def get_instrument_class(instrument_name):
+    from music21 import instrument
+    return getattr(instrument, instrument_class_names[instrument_name])
 
 
 def parse_part_name(part_name):
@@ -128,6 +101,12 @@ def make_music21_score(
             starting_tempo_quarter_duration=1.0,
             timestamp=None,
         ):
+    from music21.metadata import Metadata
+    from music21.stream import Score, Part
+    from music21.tempo import MetronomeMark
+    from music21.duration import Duration
+    from music21.meter import TimeSignature
+
     if not timestamp:
         timestamp = datetime.datetime.utcnow()
     metadata = Metadata()
@@ -157,7 +136,7 @@ def make_music21_score(
             music21_time_signature = TimeSignature(time_signature)
             part.append(music21_time_signature)
 
-        m21_instrument = instrument['class']()
+        m21_instrument = get_instrument_class(instrument_name)()
         m21_instrument.partName = instrument['name']
         m21_instrument.partAbbreviation = instrument['abbreviation']
 
@@ -176,7 +155,7 @@ def make_music21_score(
     return score
 
 
-def make_music21_note(
+def _build_music21_note(
         pitch_number=None,
         duration=1.0,
         staccato=False,
@@ -188,6 +167,24 @@ def make_music21_note(
         doit=False,
         breath_mark=False,
     ):
+    from music21.duration import Duration
+    from music21.note import Rest, Note
+    from music21.pitch import Pitch
+    from music21.chord import Chord
+    from music21.articulations import (
+        Staccato,
+        Tenuto,
+
+        Accent,
+
+        Falloff,  # An indeterminantSlide coming after the main note and going down.
+        Plop,     # An indeterminantSlide coming before the main note and going down.
+        Scoop,    # An indeterminantSlide coming before the main note and going up
+        Doit,     # An indeterminantSlide coming after the main note and going up.
+
+        BreathMark,
+    )
+
     if pitch_number == None or pitch_number == 'rest':
         n = Rest()
     elif isinstance(pitch_number, list):
@@ -226,13 +223,79 @@ def make_music21_note(
     return n
 
 
+def _clone_pitch(pitch):
+    """A copy of a Pitch with its own Accidental, which music21 changes when making notation"""
+    from music21.pitch import Pitch, Accidental
+    clone = Pitch.__new__(Pitch)
+    clone.__dict__.update(pitch.__dict__)
+    clone.groups = []
+    if pitch._accidental is not None:
+        clone._accidental = Accidental(pitch._accidental.name)
+    return clone
+
+
+def clone_music21_note(prototype):
+    """A new Note, Chord or Rest like `prototype`, much cheaper than copy.deepcopy"""
+    from music21.duration import Duration
+    from music21.note import Rest, Note
+    from music21.chord import Chord
+
+    d = Duration(prototype.duration.quarterLength)
+    if prototype.isRest:
+        n = Rest(duration=d)
+    elif prototype.isChord:
+        n = Chord([_clone_pitch(p) for p in prototype.pitches], duration=d)
+    else:
+        n = Note(_clone_pitch(prototype.pitch), duration=d)
+    n.articulations = [type(a)() for a in prototype.articulations]
+    return n
+
+
+# Prototype notes by (pitch, duration, articulation flags)
+_note_prototypes = {}
+
+
+def make_music21_note(
+        pitch_number=None,
+        duration=1.0,
+        staccato=False,
+        tenuto=False,
+        accent=False,
+        falloff=False,
+        plop=False,
+        scoop=False,
+        doit=False,
+        breath_mark=False,
+    ):
+    flags = (staccato, tenuto, accent, falloff, plop, scoop, doit, breath_mark)
+    if pitch_number == 'rest':
+        pitch_number = None
+    pitch_key = tuple(pitch_number) if isinstance(pitch_number, list) else pitch_number
+    key = (pitch_key, duration, flags)
+    if key not in _note_prototypes:
+        _note_prototypes[key] = _build_music21_note(pitch_number, duration, *flags)
+    return clone_music21_note(_note_prototypes[key])
+
+
+# The articulations a note can have, in the order they're written
+ARTICULATIONS = ('staccato', 'tenuto', 'accent', 'falloff', 'plop', 'scoop', 'doit', 'breath_mark')
+
+
 class Instrument(object):
-    """A clean in interface to a music21 part and instrument"""
-    def __init__(self, part_name, music21_part):
+    """A clean in interface to a music21 part and instrument
+
+        Notes are kept as (pitch, duration, articulations) tuples, where
+        articulations is a tuple of names from ARTICULATIONS, and only turned
+        into music21 objects if a music21 Part is asked for.
+
+    """
+    def __init__(self, part_name):
         self.part_name = part_name
         self.instrument_name, self.instrument_number = parse_part_name(part_name)
 
-        self._music21_part = music21_part
+        self.notes = []
+        self._music21_part = None
+        self._n_music21_notes = 0
 
         self.range = instrument_data[self.instrument_name]['range']
 
@@ -249,19 +312,459 @@ class Instrument(object):
             doit=False,
             breath_mark=False,
         ):
-        m21_note = make_music21_note(
-            pitch,
-            duration,
-            staccato=staccato,
-            tenuto=tenuto,
-            accent=accent,
-            falloff=falloff,
-            plop=plop,
-            scoop=scoop,
-            doit=doit,
-            breath_mark=breath_mark,
-        )
-        self._music21_part.append(m21_note)
+        flags = (staccato, tenuto, accent, falloff, plop, scoop, doit, breath_mark)
+        articulations = tuple(name for name, flag in zip(ARTICULATIONS, flags) if flag)
+        self.notes.append((pitch, duration, articulations))
+
+    def add_notes(self, notes):
+        """Add many notes at once
+
+            `notes`: (pitch, duration) or (pitch, duration, articulations)
+                     tuples, where articulations is a tuple of names from
+                     ARTICULATIONS
+
+        """
+        for note in notes:
+            if len(note) == 2:
+                note = (note[0], note[1], ())
+            self.notes.append(note)
+
+    def set_music21_part(self, music21_part):
+        self._music21_part = music21_part
+        self._n_music21_notes = 0
+
+    def get_music21_part(self):
+        """The music21 Part, with any notes added since it was last asked for appended"""
+        new_notes = []
+        for pitch, duration, articulations in self.notes[self._n_music21_notes:]:
+            flags = {name: True for name in articulations}
+            new_notes.append(make_music21_note(pitch, duration, **flags))
+        if new_notes:
+            # Appending a list updates the stream once
+            self._music21_part.append(new_notes)
+        self._n_music21_notes = len(self.notes)
+        return self._music21_part
+
+
+# Spellings of the pitch classes as (step, alter), the same as music21's defaults
+PITCH_SPELLINGS = [
+    ('C', 0), ('C', 1), ('D', 0), ('E', -1), ('E', 0), ('F', 0),
+    ('F', 1), ('G', 0), ('G', 1), ('A', 0), ('B', -1), ('B', 0),
+]
+STEPS = 'CDEFGAB'
+
+NOTE_TYPES = [
+    (Fraction(4), 'whole'),
+    (Fraction(2), 'half'),
+    (Fraction(1), 'quarter'),
+    (Fraction(1, 2), 'eighth'),
+    (Fraction(1, 4), '16th'),
+    (Fraction(1, 8), '32nd'),
+    (Fraction(1, 16), '64th'),
+    (Fraction(1, 32), '128th'),
+]
+
+# Written values with up to two dots, longest first
+NOTATED_VALUES = sorted(
+    [(value * (2 - Fraction(1, 2 ** dots)), note_type, dots) for value, note_type in NOTE_TYPES for dots in range(3)],
+    key=lambda notated: (-notated[0], notated[2]),
+)
+
+MUSICXML_ARTICULATIONS = {
+    'staccato': 'staccato',
+    'tenuto': 'tenuto',
+    'accent': 'accent',
+    'falloff': 'falloff',
+    'plop': 'plop',
+    'scoop': 'scoop',
+    'doit': 'doit',
+    'breath_mark': 'breath-mark',
+}
+
+
+def spell_pitch(pitch_number):
+    """
+    >>> spell_pitch(60), spell_pitch(70)
+    (('C', 0, 4), ('B', -1, 4))
+    """
+    step, alter = PITCH_SPELLINGS[pitch_number % 12]
+    return step, alter, pitch_number // 12 - 1
+
+
+def quarter_length_to_fraction(quarter_length):
+    return Fraction(quarter_length).limit_denominator(1000)
+
+
+def _split_written_values(quarter_length):
+    """Split a duration with a power of two denominator into written values, longest first"""
+    pieces = []
+    remaining = quarter_length
+    while remaining > 0:
+        for value, note_type, dots in NOTATED_VALUES:
+            if value <= remaining:
+                break
+        if value > remaining:
+            # Shorter than a 128th, so write what's left as one 128th tuplet note
+            ratio = NOTE_TYPES[-1][0] / remaining
+            pieces.append((remaining, '128th', 0, (ratio.numerator, ratio.denominator)))
+            break
+        pieces.append((value, note_type, dots, None))
+        remaining -= value
+    return pieces
+
+
+def split_notated_durations(quarter_length):
+    """Split a duration into written values to tie together
+
+        Returns (value, type, dots, tuplet) for each, where tuplet is None or
+        (actual notes, normal notes).
+
+        A duration that isn't a sum of written values is split into the
+        whole quarters, written normally, and the rest, written as tied notes
+        in a standard tuplet: the odd part of the denominator against the
+        power of two below it (3:2, 5:4, 7:4, 9:8 and so on).
+
+    >>> [(str(value), note_type, dots) for value, note_type, dots, tuplet in split_notated_durations(Fraction(5, 4))]
+    [('1', 'quarter', 0), ('1/4', '16th', 0)]
+    >>> split_notated_durations(Fraction(3, 2))
+    [(Fraction(3, 2), 'quarter', 1, None)]
+    >>> split_notated_durations(Fraction(1, 3))
+    [(Fraction(1, 3), 'eighth', 0, (3, 2))]
+    >>> split_notated_durations(Fraction(5, 3))
+    [(Fraction(1, 1), 'quarter', 0, None), (Fraction(2, 3), 'quarter', 0, (3, 2))]
+    >>> split_notated_durations(Fraction(7, 3))
+    [(Fraction(2, 1), 'half', 0, None), (Fraction(1, 3), 'eighth', 0, (3, 2))]
+    >>> [(str(value), note_type, tuplet) for value, note_type, dots, tuplet in split_notated_durations(Fraction(5, 6))]
+    [('2/3', 'quarter', (3, 2)), ('1/6', '16th', (3, 2))]
+    """
+    actual = quarter_length.denominator
+    while actual % 2 == 0:
+        actual //= 2
+    if actual == 1:
+        return _split_written_values(quarter_length)
+
+    normal = 2 ** (actual.bit_length() - 1)
+    tuplet_part = quarter_length % 1
+    pieces = _split_written_values(quarter_length - tuplet_part)
+    for value, note_type, dots, tuplet in _split_written_values(tuplet_part * actual / normal):
+        pieces.append((value * normal / actual, note_type, dots, tuplet or (actual, normal)))
+    return pieces
+
+
+def best_clef(pitches):
+    """Choose a clef for the pitches the way music21's Stream.bestClef does, as (sign, line, octave change)"""
+    total_height = 0
+    for pitch_number in pitches:
+        step, alter, octave = spell_pitch(pitch_number)
+        height = octave * 7 + STEPS.index(step) + 1
+        if height > 33:
+            height += 3
+        elif height < 24:
+            height -= 3
+        total_height += height
+    average_height = float(total_height) / len(pitches) if pitches else 29
+    if average_height > 52:
+        return 'G', 2, 1
+    elif average_height > 28:
+        return 'G', 2, 0
+    elif average_height > 10:
+        return 'F', 4, 0
+    return 'F', 4, -1
+
+
+def _lcm(a, b):
+    x, y = a, b
+    while y:
+        x, y = y, x % y
+    return a * b // x
+
+
+def _pitch_list(pitch):
+    """The pitches of a note as a list, empty for a rest"""
+    if pitch is None or pitch == 'rest':
+        return []
+    if isinstance(pitch, (list, tuple)):
+        return list(pitch)
+    return [pitch]
+
+
+def _musicxml_note(pitches, duration, note_type, dots, tuplet, tie_start, tie_stop, articulations):
+    lines = []
+    if not pitches:
+        pitches = [None]
+    for index, pitch_number in enumerate(pitches):
+        lines.append('      <note>')
+        if index:
+            lines.append('        <chord/>')
+        if pitch_number is None:
+            lines.append('        <rest/>')
+        else:
+            step, alter, octave = spell_pitch(pitch_number)
+            lines.append('        <pitch>')
+            lines.append('          <step>{}</step>'.format(step))
+            if alter:
+                lines.append('          <alter>{}</alter>'.format(alter))
+            lines.append('          <octave>{}</octave>'.format(octave))
+            lines.append('        </pitch>')
+        lines.append('        <duration>{}</duration>'.format(duration))
+        if tie_stop:
+            lines.append('        <tie type="stop"/>')
+        if tie_start:
+            lines.append('        <tie type="start"/>')
+        lines.append('        <type>{}</type>'.format(note_type))
+        lines.extend(['        <dot/>'] * dots)
+        if tuplet:
+            lines.append('        <time-modification>')
+            lines.append('          <actual-notes>{}</actual-notes>'.format(tuplet[0]))
+            lines.append('          <normal-notes>{}</normal-notes>'.format(tuplet[1]))
+            lines.append('        </time-modification>')
+
+        notations = []
+        if tie_stop:
+            notations.append('          <tied type="stop"/>')
+        if tie_start:
+            notations.append('          <tied type="start"/>')
+        if articulations and not index:
+            notations.append('          <articulations>')
+            for name in articulations:
+                notations.append('            <{}/>'.format(MUSICXML_ARTICULATIONS[name]))
+            notations.append('          </articulations>')
+        if notations:
+            lines.append('        <notations>')
+            lines.extend(notations)
+            lines.append('        </notations>')
+        lines.append('      </note>')
+    return '\n'.join(lines) + '\n'
+
+
+def iter_musicxml_part(
+        number,
+        notes,
+        divisions,
+        time_signature=None,
+        starting_tempo_bpm=60,
+        starting_tempo_quarter_duration=1.0,
+    ):
+    """Generate the MusicXML <part> for the `number`th part, a piece at a time"""
+    beats, beat_type = map(int, (time_signature or '4/4').split('/'))
+    measure_length = Fraction(beats * 4, beat_type)
+    tempo_value, tempo_type, tempo_dots, tempo_tuplet = split_notated_durations(quarter_length_to_fraction(starting_tempo_quarter_duration))[0]
+
+    yield '  <part id="P{}">\n'.format(number)
+
+    sign, line, octave_change = best_clef([p for pitch, duration, articulations in notes for p in _pitch_list(pitch)])
+    yield '    <measure number="1">\n'
+    yield '      <attributes>\n'
+    yield '        <divisions>{}</divisions>\n'.format(divisions)
+    yield '        <key>\n          <fifths>0</fifths>\n        </key>\n'
+    yield '        <time>\n          <beats>{}</beats>\n          <beat-type>{}</beat-type>\n        </time>\n'.format(beats, beat_type)
+    yield '        <clef>\n          <sign>{}</sign>\n          <line>{}</line>\n'.format(sign, line)
+    if octave_change:
+        yield '          <clef-octave-change>{}</clef-octave-change>\n'.format(octave_change)
+    yield '        </clef>\n'
+    yield '      </attributes>\n'
+    yield '      <direction placement="above">\n'
+    yield '        <direction-type>\n'
+    yield '          <metronome>\n'
+    yield '            <beat-unit>{}</beat-unit>\n'.format(tempo_type)
+    for _ in range(tempo_dots):
+        yield '            <beat-unit-dot/>\n'
+    yield '            <per-minute>{}</per-minute>\n'.format(starting_tempo_bpm)
+    yield '          </metronome>\n'
+    yield '        </direction-type>\n'
+    yield '        <sound tempo="{}"/>\n'.format(starting_tempo_bpm * starting_tempo_quarter_duration)
+    yield '      </direction>\n'
+
+    measure_number = 1
+    position = Fraction(0)
+    for pitch, duration, articulations in notes:
+        pitches = _pitch_list(pitch)
+        remaining = quarter_length_to_fraction(duration)
+        first = True
+        while remaining > 0:
+            if position == measure_length:
+                measure_number += 1
+                position = Fraction(0)
+                yield '    </measure>\n'
+                yield '    <measure number="{}">\n'.format(measure_number)
+
+            in_this_measure = min(remaining, measure_length - position)
+            remaining -= in_this_measure
+            position += in_this_measure
+
+            pieces = split_notated_durations(in_this_measure)
+            for index, (value, note_type, dots, tuplet) in enumerate(pieces):
+                last = remaining == 0 and index == len(pieces) - 1
+                yield _musicxml_note(
+                    pitches,
+                    int(value * divisions),
+                    note_type,
+                    dots,
+                    tuplet,
+                    tie_start=bool(pitches) and not last,
+                    tie_stop=bool(pitches) and not first,
+                    articulations=articulations if first else (),
+                )
+                first = False
+
+    if measure_number == 1 and position == 0:
+        # An empty part still needs a measure
+        for value, note_type, dots, tuplet in split_notated_durations(measure_length):
+            yield _musicxml_note([], int(value * divisions), note_type, dots, tuplet, False, False, ())
+    yield '    </measure>\n'
+    yield '  </part>\n'
+
+
+def render_musicxml_part(args):
+    """The whole MusicXML <part> as a string; the arguments are those of
+    `iter_musicxml_part`, as a tuple so it can be used with Pool.imap"""
+    return ''.join(iter_musicxml_part(*args))
+
+
+def iter_musicxml(
+        parts,
+        title='Title',
+        composer='Jonathan Marmor',
+        time_signature=None,
+        starting_tempo_bpm=60,
+        starting_tempo_quarter_duration=1.0,
+        timestamp=None,
+        processes=None,
+    ):
+    """Generate a MusicXML score a piece at a time, without music21
+
+        `parts`: a list of (part_name, notes), where notes are (pitch,
+                 duration, articulations) like in Instrument.notes
+        `processes`: if given, write the parts in parallel in a pool of this many processes
+
+    Notes that cross a barline are split and tied, and so are durations that
+    can't be written as one note.
+    """
+    if not timestamp:
+        timestamp = datetime.datetime.utcnow()
+    beats, beat_type = map(int, (time_signature or '4/4').split('/'))
+    measure_length = Fraction(beats * 4, beat_type)
+
+    # Enough divisions per quarter to write every duration exactly
+    divisions = measure_length.denominator
+    for part_name, notes in parts:
+        for pitch, duration, articulations in notes:
+            divisions = _lcm(divisions, quarter_length_to_fraction(duration).denominator)
+
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">\n'
+    yield '<score-partwise version="3.0">\n'
+    yield '  <movement-title>{}</movement-title>\n'.format(escape(title))
+    yield '  <identification>\n'
+    yield '    <creator type="composer">{}</creator>\n'.format(escape(composer))
+    yield '    <encoding>\n'
+    yield '      <encoding-date>{}</encoding-date>\n'.format(timestamp.strftime('%Y-%m-%d'))
+    yield '    </encoding>\n'
+    yield '  </identification>\n'
+
+    yield '  <part-list>\n'
+    for number, (part_name, notes) in enumerate(parts, 1):
+        instrument_name, instrument_number = parse_part_name(part_name)
+        name = instrument_data[instrument_name]['name']
+        abbreviation = instrument_data[instrument_name]['abbreviation']
+        if instrument_number > 1:
+            name = '{} {}'.format(name, instrument_number)
+            abbreviation = '{} {}'.format(abbreviation, instrument_number)
+        yield '    <score-part id="P{}">\n'.format(number)
+        yield '      <part-name>{}</part-name>\n'.format(escape(name))
+        yield '      <part-abbreviation>{}</part-abbreviation>\n'.format(escape(abbreviation))
+        yield '    </score-part>\n'
+    yield '  </part-list>\n'
+
+    part_args = [
+        (number, notes, divisions, time_signature, starting_tempo_bpm, starting_tempo_quarter_duration)
+        for number, (part_name, notes) in enumerate(parts, 1)
+    ]
+    if processes:
+        # Each part is written by its own process and they're put together in order here
+        pool = Pool(processes)
+        try:
+            for part_xml in pool.imap(render_musicxml_part, part_args):
+                yield part_xml
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for args in part_args:
+            for chunk in iter_musicxml_part(*args):
+                yield chunk
+
+    yield '</score-partwise>\n'
+
+
+def write_musicxml(path, parts, **kwargs):
+    """Write a MusicXML file streaming from `iter_musicxml`, which takes the same arguments"""
+    with open(path, 'w') as f:
+        for chunk in iter_musicxml(parts, **kwargs):
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            f.write(chunk)
+    return path
+
+
+MXL_CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container>
+  <rootfiles>
+    <rootfile full-path="{}"/>
+  </rootfiles>
+</container>
+"""
+
+
+def write_mxl(path, parts, **kwargs):
+    """Write a compressed MusicXML file: a zip of the score and a META-INF/container.xml pointing to it
+
+        music21 2.0.10 writes plain MusicXML even when asked for 'mxl', so
+        this makes the archive itself.
+    """
+    score_name = os.path.splitext(os.path.basename(path))[0] + '.xml'
+    chunks = []
+    for chunk in iter_musicxml(parts, **kwargs):
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        chunks.append(chunk)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('META-INF/container.xml', MXL_CONTAINER.format(score_name))
+        archive.writestr(score_name, ''.join(chunks))
+    return path
+
+
+def validate_musicxml(path, parts):
+    """Read a MusicXML file back with music21 and check each part has the notes of `parts`
+
+        Raises a ValueError if it doesn't.
+    """
+    from music21 import converter
+
+    # forceSource, so a cached parse of an earlier file at the same path is never used
+    score = converter.parse(path, forceSource=True)
+    if len(score.parts) != len(parts):
+        raise ValueError('Expected {} parts, read {}'.format(len(parts), len(score.parts)))
+    for (part_name, notes), music21_part in zip(parts, score.parts):
+        expected_duration = sum(quarter_length_to_fraction(duration) for pitch, duration, articulations in notes)
+        read_duration = quarter_length_to_fraction(music21_part.flat.notesAndRests.highestTime)
+        if expected_duration != read_duration:
+            raise ValueError('{}: expected a duration of {}, read {}'.format(part_name, expected_duration, read_duration))
+
+        expected_pitches = [sorted(_pitch_list(pitch)) for pitch, duration, articulations in notes if _pitch_list(pitch) and duration > 0]
+        read_pitches = []
+        for note in music21_part.flat.notes:
+            if note.tie is None or note.tie.type == 'start':
+                read_pitches.append(sorted(int(p.ps) for p in note.pitches))
+        if expected_pitches != read_pitches:
+            raise ValueError('{}: the pitches read back are different'.format(part_name))
+
+
+OUTPUT_EXTENSIONS = {
+    'musicxml': 'xml',
+    'mxl': 'mxl',
+    'midi': 'mid',
+}
 
 
 class Notation(object):
@@ -285,27 +788,114 @@ class Notation(object):
         self.create_output_dir()
 
         self.part_names = part_names
+        self.title = title
+        self.composer = composer
+        self.time_signature = time_signature
+        self.starting_tempo_bpm = starting_tempo_bpm
+        self.starting_tempo_quarter_duration = starting_tempo_quarter_duration
 
-        # Make Music21 Score, Parts, and Instruments
-        self._score = make_music21_score(
-            part_names=part_names,
-            title=title,
-            composer=composer,
-            time_signature=time_signature,
-            starting_tempo_bpm=starting_tempo_bpm,
-            starting_tempo_quarter_duration=starting_tempo_quarter_duration,
-            timestamp=self.timestamp,
-        )
+        # The music21 Score is only made if it's needed
+        self._score = None
 
-        # Instantiate parts and instruments and make them accessible via Notation
+        # Instantiate instruments and make them accessible via Notation
         self.instruments = []
         self.parts_by_name = {}
-        for part_name, music21_part in zip(self.part_names, self._score.parts):
-            instrument = Instrument(part_name, music21_part)
+        for part_name in self.part_names:
+            instrument = Instrument(part_name)
             setattr(self, part_name, instrument)
             self.instruments.append(instrument)
             self.parts_by_name[part_name] = instrument
 
+    def get_music21_score(self):
+        if self._score is None:
+            self.set_music21_scratch_dir()
+            self._score = make_music21_score(
+                part_names=self.part_names,
+                title=self.title,
+                composer=self.composer,
+                time_signature=self.time_signature,
+                starting_tempo_bpm=self.starting_tempo_bpm,
+                starting_tempo_quarter_duration=self.starting_tempo_quarter_duration,
+                timestamp=self.timestamp,
+            )
+            for instrument, music21_part in zip(self.instruments, self._score.parts):
+                instrument.set_music21_part(music21_part)
+        for instrument in self.instruments:
+            instrument.get_music21_part()
+        return self._score
+
+    def write_musicxml(self, path=None, validate=False, processes=None):
+        """Write the score straight to a MusicXML file, without music21
+
+            `path`: by default a new file in the output directory (see `make_output_path`)
+            `validate`: if True, read the file back with music21 and check it
+            `processes`: if given, write the parts in parallel in a pool of this many processes
+
+        """
+        if path is None:
+            path = self.make_output_path('xml')
+        parts = [(instrument.part_name, instrument.notes) for instrument in self.instruments]
+        write_musicxml(
+            path,
+            parts,
+            title=self.title,
+            composer=self.composer,
+            time_signature=self.time_signature,
+            starting_tempo_bpm=self.starting_tempo_bpm,
+            starting_tempo_quarter_duration=self.starting_tempo_quarter_duration,
+            timestamp=self.timestamp,
+            processes=processes,
+        )
+        if validate:
+            validate_musicxml(path, parts)
+        return path
+
+    def write(self, path=None, fmt='musicxml', processes=None):
+        """Write the score to a file without opening a notation app
+
+            `fmt`: 'musicxml', 'mxl' (compressed MusicXML) or 'midi'
+            `path`: by default a new file in the output directory (see `make_output_path`)
+            `processes`: if given, write MusicXML or mxl parts in parallel in a pool of this many processes
+
+        MusicXML and mxl are written directly; MIDI is made by music21.
+        Returns the path written.
+        """
+        if fmt not in OUTPUT_EXTENSIONS:
+            raise ValueError('Unknown notation format: {}'.format(fmt))
+        if path is None:
+            path = self.make_output_path(OUTPUT_EXTENSIONS[fmt])
+
+        if fmt == 'musicxml':
+            return self.write_musicxml(path, processes=processes)
+        elif fmt == 'mxl':
+            return write_mxl(
+                path,
+                [(instrument.part_name, instrument.notes) for instrument in self.instruments],
+                title=self.title,
+                composer=self.composer,
+                time_signature=self.time_signature,
+                starting_tempo_bpm=self.starting_tempo_bpm,
+                starting_tempo_quarter_duration=self.starting_tempo_quarter_duration,
+                timestamp=self.timestamp,
+                processes=processes,
+            )
+        return self.get_music21_score().write('midi', path)
+
+    def make_output_path(self, extension):
+        """A new, empty file in the output directory named after the title and timestamp
+
+            The file is created here so runs writing at the same time never
+            get the same name.
+
+        """
+        prefix = '{}_{}_'.format(
+            re.sub(r'[^A-Za-z0-9]+', '_', self.title).strip('_'),
+            self.timestamp.strftime('%Y-%m-%d_%H-%M-%S-%f'),
+        )
+        fd, path = tempfile.mkstemp(suffix='.' + extension, prefix=prefix, dir=self.output_dir)
+        os.close(fd)
+        return path
+
     def create_output_dir(self):
         self.output_dir = os.path.join(self.output_dir_parent, self.output_dir_name)
 
@@ -313,8 +903,23 @@ class Notation(object):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        # Set up temp file directory
+    def set_music21_scratch_dir(self):
+        from music21 import environment
         environment.set('directoryScratch', self.output_dir)
 
-    def show(self):
-        show(self._score)
+    def show(self, use_music21=False):
+        """Open the score in the notation app
+
+            By default the MusicXML is written directly. With `use_music21`,
+            the score is built and shown with music21 instead.
+
+        """
+        if use_music21:
+            show(self.get_music21_score())
+        else:
+            subprocess.call(['open', '-a', which_notation_app(), self.write_musicxml()])
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,147 @@
+"""Weighted random sampling.
+
+Sampler.choice is for one-off distributions (a cumulative sum and a binary
+search per draw). AliasTable is for distributions that are drawn from over and
+over, like duration and rest weight tables: it's built once in O(n) and then
+every draw is O(1) (Walker/Vose alias method).
+
+Each Sampler has its own random state, so a seeded Sampler gives the same draws
+every run. The module level functions use `default_sampler`, which draws from
+numpy's global random state, so np.random.seed() seeds them too.
+
+>>> sampler = Sampler(seed=1)
+>>> durations = sampler.alias_table([1, 2, 4], [16, 2, 1])
+>>> durations.draw(size=8)
+[2, 1, 1, 1, 1, 1, 1, 1]
+>>> Sampler(seed=1).alias_table([1, 2, 4], [16, 2, 1]).draw(size=8)
+[2, 1, 1, 1, 1, 1, 1, 1]
+>>> sampler.choice(['a', 'b'], [0, 1])
+'b'
+>>> sampler.choice([], []) is None
+True
+
+"""
+
+import numpy as np
+
+
+class AliasTable(object):
+    def __init__(self, options, weights, random_state=np.random):
+        """A fixed discrete distribution over `options`, built for fast repeated draws
+
+            `options`: a list of anything
+            `weights`: relative weights, one per option
+            `random_state`: a numpy RandomState, or the np.random module
+
+        """
+        if len(options) != len(weights):
+            raise ValueError('There must be one weight per option')
+        if not len(options):
+            raise ValueError('An AliasTable needs at least one option')
+
+        self.options = list(options)
+        self.random_state = random_state
+
+        n = len(weights)
+        weights = np.asarray(weights, dtype=float)
+        total = weights.sum()
+        if total <= 0:
+            raise ValueError('Weights must add up to more than 0')
+        scaled = weights * n / total
+
+        self.probabilities = np.ones(n)
+        self.aliases = np.arange(n)
+
+        small = [i for i in xrange(n) if scaled[i] < 1.0]
+        large = [i for i in xrange(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.probabilities[s] = scaled[s]
+            self.aliases[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Anything left over is 1.0 give or take rounding error
+        for i in small + large:
+            self.probabilities[i] = 1.0
+
+    def draw_indexes(self, size=None):
+        columns = self.random_state.randint(0, len(self.options), size=size)
+        coin = self.random_state.random_sample(size=size)
+        return np.where(coin < self.probabilities[columns], columns, self.aliases[columns])
+
+    def draw(self, size=None):
+        """Draw one option, or a list of `size` options"""
+        indexes = self.draw_indexes(size=size)
+        if size is None:
+            return self.options[int(indexes)]
+        return [self.options[i] for i in indexes]
+
+
+class Sampler(object):
+    def __init__(self, seed=None, random_state=None):
+        """Weighted random choices from a random state of its own
+
+            With a `seed`, makes a new RandomState from it. Otherwise uses
+            `random_state`, by default numpy's global random state.
+
+        """
+        if seed is not None:
+            random_state = np.random.RandomState(seed)
+        elif random_state is None:
+            random_state = np.random
+        self.random_state = random_state
+
+    def seed(self, seed):
+        self.random_state.seed(seed)
+
+    def choice_indexes(self, weights, size=None):
+        cumulative = np.cumsum(weights, dtype=float)
+        total = cumulative[-1]
+        if total <= 0:
+            raise ValueError('Weights must add up to more than 0')
+        indexes = np.searchsorted(cumulative, self.random_state.random_sample(size=size) * total, side='right')
+        # Rounding can land exactly on the total; that belongs to the last option with any weight
+        return np.minimum(indexes, np.searchsorted(cumulative, total))
+
+    def choice(self, options, weights, size=None):
+        """Pick one of `options` (or a list of `size` of them) with probability proportional to `weights`
+
+            Returns None if there are no options.
+
+        """
+        if len(options) != len(weights):
+            raise ValueError('There must be one weight per option')
+        if not len(options):
+            return None
+        indexes = self.choice_indexes(weights, size=size)
+        if size is None:
+            return options[int(indexes)]
+        return [options[i] for i in indexes]
+
+    def alias_table(self, options, weights):
+        """Make an AliasTable that draws from this Sampler's random state"""
+        return AliasTable(options, weights, random_state=self.random_state)
+
+
+default_sampler = Sampler()
+
+
+def seed(seed):
+    default_sampler.seed(seed)
+
+
+def weighted_choice(options, weights, size=None):
+    return default_sampler.choice(options, weights, size=size)
+
+
+def alias_table(options, weights):
+    return default_sampler.alias_table(options, weights)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
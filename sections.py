@@ -10,21 +10,24 @@ audio_duration_seconds = 120
 audio = Audio(audio_duration_seconds)
 len_audio = len(audio)
 
-layer_1 = Sections(4, len_audio)
-layer_2 = Sections([1, 1, 2, 1, 1, 2], len_audio)
+layer_1 = Layer(4, len_audio)
+layer_2 = Layer([1, 1, 2, 1, 1, 2], len_audio)
 
 offsets = [int(round(o)) for o in np.linspace(0, len_audio, 16, endpoint=False)]
 for offset in offsets:
-    layer_1_index = layer_1.get_by_sample_offset(offset).index
-    layer_2_index = layer_2.get_by_sample_offset(offset).index
+    layer_1_index = layer_1.get_by_ticks_offset(offset).index
+    layer_2_index = layer_2.get_by_ticks_offset(offset).index
     print offset, layer_1_index, layer_2_index
 
+# Or for every sample at once
+layer_1_indices = layer_1.get_indices(np.arange(len_audio))
+
 """
 
 
 import numpy as np
 
-from utils import scale
+from utils import LazyList, scale
 
 
 def quarter_duration_to_ticks(quarter_duration, ticks_per_quarter=32):
@@ -89,6 +92,10 @@ class Layer(list):
 
         self.next_starts = self.starts[1:] + [self.n_ticks + 1]
 
+        # For binary searching
+        self._starts = np.array(self.starts)
+        self._next_starts = np.array(self.next_starts)
+
         index = 0
         for start, next_start in zip(self.starts, self.next_starts):
             section = Section(start, next_start, index, self.n_sections, self)
@@ -101,9 +108,16 @@ class Layer(list):
         return self.get_by_ticks_offset(ticks_offset)
 
     def get_by_ticks_offset(self, ticks_offset):
-        for section in self:
-            if section.start <= ticks_offset < section.next_start:
-                return section
+        index = np.searchsorted(self._starts, ticks_offset, side='right') - 1
+        if index >= 0 and ticks_offset < self.next_starts[index]:
+            return self[index]
+
+    def get_indices(self, ticks_offsets):
+        '''Get the index of the Section at each of an array of tick offsets, or -1 where there isn't one'''
+        ticks_offsets = np.asarray(ticks_offsets)
+        indices = np.searchsorted(self._starts, ticks_offsets, side='right') - 1
+        found = (indices >= 0) & (ticks_offsets < self._next_starts[np.maximum(indices, 0)])
+        return np.where(found, indices, -1)
 
     def get_in_window(self, offset, duration, ticks_per_quarter=32):
         '''Get all the Sections in this Layer happening between offset and offset + duration, where both are quarter durations'''
@@ -114,14 +128,93 @@ class Layer(list):
 
     def get_in_window_by_ticks(self, offset, duration):
         next_start = offset + duration
-        result = []
-        for section in self:
-            if section.next_start <= offset:
-                continue
-            if section.start >= next_start:
-                break
-            result.append(section)
-        return result
+        first = np.searchsorted(self._next_starts, offset, side='right')
+        last = np.searchsorted(self._starts, next_start, side='left')
+        return self[first:max(first, last)]
+
+
+class EqualLayer(LazyList, Layer):
+    def __init__(self, n_sections, n_ticks):
+        """A Layer of `n_sections` equal Sections that are only made when they're needed
+
+            Section k is made from start k. The starts are the same as Layer's.
+            Iterating makes all the Sections.
+
+        """
+        self._init_lazy(n_sections)
+        self.n_ticks = n_ticks
+        self.n_sections = n_sections
+
+        # Round half up, the same as round() for these non-negative starts
+        starts = np.linspace(0, self.n_ticks, self.n_sections, endpoint=False)
+        rounded = np.floor(starts)
+        rounded += (starts - rounded) >= .5
+        self.starts = self._starts = rounded.astype(int)
+        self.next_starts = self._next_starts = np.append(self.starts[1:], self.n_ticks + 1)
+
+    def _make_item(self, index):
+        return Section(int(self.starts[index]), int(self.next_starts[index]), index, self.n_sections, self)
+
+
+class LayersSnapshot(object):
+    def __init__(self, layers):
+        """The section boundaries of every layer in a Layers, stacked into matrices
+
+            Row n is the layer named `layer_names[n]`, padded past its last
+            section with n_ticks + 1, where no section can be. Each query is
+            one np.searchsorted over all the layers at once: every row is
+            shifted up into its own band of values, so the flattened matrix
+            is still sorted.
+
+        """
+        self.layer_names = list(layers.layer_names)
+        self.n_ticks = layers.n_ticks
+        self.n_sections = np.array([len(layers[name]) for name in self.layer_names])
+
+        n_layers = len(self.layer_names)
+        n_columns = max(self.n_sections) if n_layers else 0
+        self.starts = np.full((n_layers, n_columns), self.n_ticks + 1)
+        self.next_starts = np.full((n_layers, n_columns), self.n_ticks + 1)
+        for row, name in enumerate(self.layer_names):
+            layer = layers[name]
+            self.starts[row, :len(layer)] = layer.starts
+            self.next_starts[row, :len(layer)] = layer.next_starts
+
+        # Queries are clipped to -1 to n_ticks + 1, so bands this wide don't overlap
+        width = self.n_ticks + 3
+        self._shifts = np.arange(n_layers) * width
+        self._row_starts = np.arange(n_layers) * n_columns
+        self._flat_starts = (self.starts + self._shifts[:, np.newaxis]).ravel()
+        self._flat_next_starts = (self.next_starts + self._shifts[:, np.newaxis]).ravel()
+
+    def _search(self, flat, ticks, side):
+        ticks = np.clip(np.asarray(ticks, dtype=float), -1, self.n_ticks + 1)
+        positions = np.searchsorted(flat, ticks[..., np.newaxis] + self._shifts, side=side)
+        return positions - self._row_starts
+
+    def get_indices(self, ticks):
+        '''The index of the section of each layer at each tick offset (or -1 if there isn't one)
+
+            For a single tick offset, returns an array with one index per
+            layer; for an array of them, a matrix with a row per offset and a
+            column per layer.
+        '''
+        indices = self._search(self._flat_starts, ticks, 'right') - 1
+        columns = np.minimum(np.maximum(indices, 0), self.n_sections - 1)
+        next_starts = self.next_starts[np.arange(len(self.layer_names)), columns]
+        found = (indices >= 0) & (indices < self.n_sections) & (np.asarray(ticks)[..., np.newaxis] < next_starts)
+        return np.where(found, indices, -1)
+
+    def get_window_indices(self, ticks, duration_ticks):
+        '''The sections of each layer happening between each tick offset and tick offset + duration_ticks
+
+            Returns two arrays shaped like `get_indices`: the index of the
+            first section and one past the last.
+        '''
+        next_ticks = np.asarray(ticks) + np.asarray(duration_ticks)
+        first = np.minimum(self._search(self._flat_next_starts, ticks, 'right'), self.n_sections)
+        last = np.minimum(self._search(self._flat_starts, next_ticks, 'left'), self.n_sections)
+        return first, np.maximum(first, last)
 
 
 class Layers(dict):
@@ -132,8 +225,76 @@ class Layers(dict):
 
         self.n_ticks = n_quarters * ticks_per_quarter
 
+        # In the order they were added
+        self.layer_names = []
+        self._snapshot = None
+
         self.init_meter()
 
+    def __setitem__(self, name, layer):
+        if name not in self:
+            self.layer_names.append(name)
+        dict.__setitem__(self, name, layer)
+        self._snapshot = None
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self.layer_names.remove(name)
+        self._snapshot = None
+
+    # The rest of dict's changing methods go through __setitem__ and
+    # __delitem__ so layer_names and the snapshot stay up to date
+
+    _missing = object()
+
+    def pop(self, name, default=_missing):
+        if name not in self:
+            if default is Layers._missing:
+                raise KeyError(name)
+            return default
+        layer = self[name]
+        del self[name]
+        return layer
+
+    def popitem(self):
+        if not self.layer_names:
+            raise KeyError('popitem(): Layers is empty')
+        name = self.layer_names[-1]
+        return name, self.pop(name)
+
+    def setdefault(self, name, layer=None):
+        if name not in self:
+            self[name] = layer
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for name, layer in dict(*args, **kwargs).items():
+            self[name] = layer
+
+    def clear(self):
+        for name in list(self.layer_names):
+            del self[name]
+
+    def snapshot(self):
+        '''A LayersSnapshot of the current layers, made again only after layers are added'''
+        if self._snapshot is None:
+            self._snapshot = LayersSnapshot(self)
+        return self._snapshot
+
+    def get_indices(self, offsets, ticks_per_quarter=None):
+        '''The index of the Section of every layer (in `layer_names` order) at each of `offsets` (in quarters), or -1'''
+        if ticks_per_quarter is None:
+            ticks_per_quarter = self.ticks_per_quarter
+        return self.snapshot().get_indices(np.asarray(offsets) * ticks_per_quarter)
+
+    def get_window_indices(self, offsets, durations, ticks_per_quarter=None):
+        '''For every layer (in `layer_names` order), the index of the first Section happening between each offset and offset + duration (in quarters), and one past the last'''
+        if ticks_per_quarter is None:
+            ticks_per_quarter = self.ticks_per_quarter
+        ticks = np.trunc(np.asarray(offsets) * ticks_per_quarter)
+        duration_ticks = np.trunc(np.asarray(durations) * ticks_per_quarter)
+        return self.snapshot().get_window_indices(ticks, duration_ticks)
+
 
     def init_meter(self):
         self.quarter_duration_seconds = 60.0 / self.bpm
@@ -160,11 +321,18 @@ class Layers(dict):
 
         # self.metrical_hierarchy = self.add_layer
 
-    def get(self, offset, duration=0.0):
-        return {layer_name:self[layer_name].get(offset, duration=duration) for layer_name in self}
+    def get(self, offset, duration=0.0, ticks_per_quarter=32):
+        indices = self.get_indices(offset, ticks_per_quarter=ticks_per_quarter).tolist()
+        return {layer_name: self[layer_name][index] if index >= 0 else None for layer_name, index in zip(self.layer_names, indices)}
 
     def add_layer(self, name, sections):
-        self[name] = Layer(sections, self.n_ticks)
+        if isinstance(sections, int):
+            layer = EqualLayer(sections, self.n_ticks)
+        else:
+            layer = Layer(sections, self.n_ticks)
+        self[name] = layer
+        return layer
 
     def get_in_window(self, offset, duration, ticks_per_quarter=32):
-        return {layer_name:self[layer_name].get_in_window(offset, duration, ticks_per_quarter=ticks_per_quarter) for layer_name in self}
+        first, last = self.get_window_indices(offset, duration, ticks_per_quarter=ticks_per_quarter)
+        return {layer_name: self[layer_name][start:stop] for layer_name, start, stop in zip(self.layer_names, first.tolist(), last.tolist())}
@@ -5,10 +5,13 @@ import itertools
 from collections import Counter
 import os
 import math
+from bisect import bisect_right
 from datetime import datetime
 
 import numpy as np
 
+import sampling
+
 
 def random_from_range(a, b, size=None):
     return (b - a) * np.random.random(size=size) + a
@@ -77,11 +80,11 @@ def find_loops(seq):
 
 def weighted_choice(indexes, weights):
     # Make weights sum to 1.0
-    sum_weights = float(sum(weights))
-    weights = [w / sum_weights for w in weights]
+    weights = np.asarray(weights, dtype=float)
+    weights = (weights / weights.sum()).tolist()
 
     # Weighted choice
-    index = np.random.choice(indexes, p=weights)
+    index = sampling.weighted_choice(indexes, weights)
 
     return index, weights
 
@@ -269,8 +272,16 @@ def split_list(lst, n_chunks):
 
     '''
     chunk_size = len(lst) / float(n_chunks)
-    for bottom, top in pairwise(chunk_size * i for i in xrange(n_chunks + 1)):
-        chunk = [p for i, p in enumerate(lst) if bottom <= (i + .5) < top]
+    boundaries = [chunk_size * i for i in xrange(n_chunks + 1)]
+
+    # Put each item in the chunk whose boundaries its middle falls between, in one pass
+    chunks = [[] for _ in xrange(n_chunks)]
+    for i, p in enumerate(lst):
+        chunk_index = bisect_right(boundaries, i + .5) - 1
+        if 0 <= chunk_index < n_chunks:
+            chunks[chunk_index].append(p)
+
+    for chunk in chunks:
         yield chunk
 
 
@@ -296,6 +307,89 @@ def subdivide_duration(relative_durations, duration):
 
 
 
+class LazyList(list):
+    """A list whose items are made by `_make_item(index)` the first time they're needed
+
+    Subclasses call `_init_lazy(length)` and define `_make_item`. Indexing
+    and slicing only make the items asked for. Anything that needs the whole
+    list (iterating, comparing, changing it, etc) makes all of them first.
+
+    >>> class Squares(LazyList):
+    ...     def __init__(self, n):
+    ...         self._init_lazy(n)
+    ...     def _make_item(self, index):
+    ...         return index ** 2
+    >>> squares = Squares(1000000)
+    >>> len(squares), squares[-1], squares[2:5]
+    (1000000, 999998000001, [4, 9, 16])
+    >>> squares = Squares(4)
+    >>> list(squares), 9 in squares
+    ([0, 1, 4, 9], True)
+    """
+    def _init_lazy(self, length):
+        self._length = length
+        self._made = {}
+        self._materialized = False
+
+    def _make_item(self, index):
+        raise NotImplementedError('{} must define _make_item'.format(type(self).__name__))
+
+    def _item(self, index):
+        if index not in self._made:
+            self._made[index] = self._make_item(index)
+        return self._made[index]
+
+    def materialize(self):
+        if not self._materialized:
+            items = [self._item(index) for index in xrange(self._length)]
+            self._materialized = True
+            self._made = None
+            list.extend(self, items)
+
+    def __len__(self):
+        if self._materialized:
+            return list.__len__(self)
+        return self._length
+
+    def __getitem__(self, index):
+        if self._materialized:
+            return list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return [self._item(i) for i in xrange(*index.indices(self._length))]
+        index = int(index)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('list index out of range')
+        return self._item(index)
+
+    def __getslice__(self, start, stop):
+        return self.__getitem__(slice(max(start, 0), max(stop, 0)))
+
+    def __iter__(self):
+        self.materialize()
+        return list.__iter__(self)
+
+
+def _materializing(method):
+    def wrapper(self, *args, **kwargs):
+        self.materialize()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in [
+        '__contains__', '__reversed__', '__repr__', '__str__',
+        '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+        '__add__', '__mul__', '__rmul__', '__iadd__', '__imul__',
+        '__setitem__', '__delitem__', '__setslice__', '__delslice__',
+        'append', 'extend', 'insert', 'pop', 'remove', 'index', 'count', 'sort', 'reverse',
+    ]:
+    setattr(LazyList, _name, _materializing(getattr(list, _name)))
+del _name
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()